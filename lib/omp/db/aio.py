@@ -0,0 +1,178 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Note: this module requires Python 3 and the aiomysql package.
+
+import aiomysql
+
+from omp.db.backend.mysql import default_use_unicode
+from omp.db.db import OMPDB, QueryResult
+from omp.error import OMPDBError
+
+
+class AsyncOMPDB(object):
+    """Asynchronous OMP and JCMT database access class.
+
+    This provides coroutine versions of some of the OMPDB query
+    methods, so that independent queries can be run concurrently,
+    e.g. with asyncio.gather.  The queries are prepared by the same
+    query plan methods as OMPDB uses, and run via a pool of
+    aiomysql connections.
+
+    The pool is created by the open coroutine, or on entering
+    the object as an asynchronous context manager::
+
+        async with AsyncOMPDB(server=..., user=..., password=...) as db:
+            (info, faults) = await asyncio.gather(
+                db.get_project_info(project),
+                db.get_fault_summary(project))
+    """
+
+    # Share the query building methods of the synchronous class.
+    _latest_obslog_join = OMPDB._latest_obslog_join
+    _plan_acsis_info = OMPDB._plan_acsis_info
+    _plan_fault_summary = OMPDB._plan_fault_summary
+    _plan_observations_from_project = OMPDB._plan_observations_from_project
+    _plan_project_info = OMPDB._plan_project_info
+    _plan_remaining_msb_info = OMPDB._plan_remaining_msb_info
+    _plan_summary_msb_info = OMPDB._plan_summary_msb_info
+    _plan_time_charged_project_info = OMPDB._plan_time_charged_project_info
+
+    def __init__(self, server, user, password, dev=False,
+                 pool_size=4, use_unicode=None):
+        """Construct new asynchronous database object.
+
+        The connection pool is not opened until the open coroutine
+        is called.
+        """
+
+        prefix = ('dev' if dev else '')
+
+        self.jcmt_db = '{}jcmt.'.format(prefix)
+        self.omp_db = '{}omp.'.format(prefix)
+
+        if use_unicode is None:
+            use_unicode = default_use_unicode
+
+        self._connect_args = {
+            'host': server,
+            'user': user,
+            'password': password,
+            'use_unicode': use_unicode,
+            'autocommit': False,
+            'minsize': 1,
+            'maxsize': pool_size,
+        }
+
+        self._pool = None
+
+    async def open(self):
+        """Open the connection pool."""
+
+        if self._pool is None:
+            self._pool = await aiomysql.create_pool(**self._connect_args)
+
+    async def close(self):
+        """Close the connection pool, waiting for connections
+        to be released."""
+
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, type_, value, tb):
+        await self.close()
+
+    async def _fetch_plan(self, plan):
+        """Execute the queries of a QueryPlan in a read-only transaction
+        on a connection from the pool."""
+
+        if self._pool is None:
+            raise OMPDBError('connection pool is not open')
+
+        results = []
+
+        try:
+            async with self._pool.acquire() as conn:
+                try:
+                    async with conn.cursor() as c:
+                        for (query, args) in plan.queries:
+                            if not query.upper().startswith('SELECT'):
+                                raise OMPDBError(
+                                    'non-select query in read-only '
+                                    'transaction')
+
+                            await c.execute(query, args)
+                            rows = await c.fetchall()
+                            results.append(QueryResult(rows, c.description))
+
+                finally:
+                    await conn.rollback()
+
+        except aiomysql.Error as e:
+            raise OMPDBError(str(e))
+
+        return results
+
+    async def _run_plan(self, plan):
+        """Execute a QueryPlan and process its results."""
+
+        return plan.process(await self._fetch_plan(plan))
+
+    async def get_acsis_info(self, projectcode):
+        """See OMPDB.get_acsis_info."""
+
+        return await self._run_plan(self._plan_acsis_info(projectcode))
+
+    async def get_fault_summary(self, projectpattern):
+        """See OMPDB.get_fault_summary."""
+
+        return await self._run_plan(self._plan_fault_summary(projectpattern))
+
+    async def get_observations_from_project(
+            self, projectcode, utdatestart=None, utdateend=None,
+            instrument=None, ompstatus=None):
+        """See OMPDB.get_observations_from_project."""
+
+        return await self._run_plan(self._plan_observations_from_project(
+            projectcode, utdatestart, utdateend, instrument, ompstatus))
+
+    async def get_project_info(self, projectcode):
+        """See OMPDB.get_project_info."""
+
+        return await self._run_plan(self._plan_project_info(projectcode))
+
+    async def get_remaining_msb_info(self, projectcode):
+        """See OMPDB.get_remaining_msb_info."""
+
+        return await self._run_plan(
+            self._plan_remaining_msb_info(projectcode))
+
+    async def get_summary_msb_info(self, projectpattern):
+        """See OMPDB.get_summary_msb_info."""
+
+        return await self._run_plan(
+            self._plan_summary_msb_info(projectpattern))
+
+    async def get_time_charged_project_info(self, projectcode):
+        """See OMPDB.get_time_charged_project_info."""
+
+        return await self._run_plan(
+            self._plan_time_charged_project_info(projectcode))
@@ -0,0 +1,94 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+from mysql.connector import FieldType
+
+from omp.error import OMPDBError
+
+# NumPy data types (and the value used in place of NULL) by MySQL
+# field type.  Other field types are stored in object arrays.
+_column_types = {}
+
+for (_field_types, _column_type) in (
+        (('TINY', 'SHORT', 'LONG', 'LONGLONG', 'INT24', 'YEAR'),
+         ('int64', 0)),
+        (('FLOAT', 'DOUBLE', 'DECIMAL', 'NEWDECIMAL'),
+         ('float64', float('nan'))),
+        (('DATE', 'NEWDATE'),
+         ('datetime64[D]', None)),
+        (('DATETIME', 'TIMESTAMP'),
+         ('datetime64[us]', None)),
+        (('TIME',),
+         ('timedelta64[us]', None)),
+        ):
+    for _field_type in _field_types:
+        _column_types[getattr(FieldType, _field_type)] = _column_type
+
+
+def fetch_arrays(cursor, batch_size, names=None):
+    """Fetch the results of a query as a dictionary of NumPy arrays.
+
+    Rows are fetched from the cursor in batches of the given size and
+    converted to typed columns, so that the full result set is not held
+    as Python tuples.  Dates and times become datetime64 values.
+
+    Returns an OrderedDict of masked arrays, by column name, in which
+    NULL values are masked.  Alternative column names can be given.
+    """
+
+    import numpy as np
+
+    description = cursor.description
+
+    if names is None:
+        names = [x[0] for x in description]
+    elif len(names) != len(description):
+        raise OMPDBError('number of names does not match columns')
+
+    types = [_column_types.get(x[1], (object, None)) for x in description]
+    data = [[] for x in description]
+    masks = [[] for x in description]
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+
+        for (i, (dtype, null)) in enumerate(types):
+            values = [row[i] for row in rows]
+            mask = np.array([x is None for x in values], dtype=bool)
+
+            if mask.any():
+                values = [null if x is None else x for x in values]
+
+            data[i].append(np.array(values, dtype=dtype))
+            masks[i].append(mask)
+
+    result = OrderedDict()
+
+    for (name, (dtype, null), data_i, mask_i) in zip(
+            names, types, data, masks):
+        if data_i:
+            result[name] = np.ma.MaskedArray(
+                np.concatenate(data_i), mask=np.concatenate(mask_i))
+        else:
+            result[name] = np.ma.MaskedArray(
+                np.array([], dtype=dtype), mask=np.array([], dtype=bool))
+
+    return result
@@ -17,19 +17,341 @@
 from __future__ import absolute_import
 
 from contextlib import contextmanager
-from threading import Lock
+from threading import Condition, Lock
+from time import time
 from types import MethodType
 from sys import version_info
 
 import mysql.connector
+from mysql.connector import errorcode
 
-from omp.error import OMPDBError
+from omp.error import OMPDBError, OMPDBTransientError
 
 if version_info[0] < 3:
     default_use_unicode = False
 else:
     default_use_unicode = True
 
+# Error numbers indicating that the connection to the server was lost.
+connection_lost_errors = frozenset((
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.CR_SERVER_LOST_EXTENDED,
+))
+
+# Error numbers for which repeating the transaction may succeed.
+transient_errors = connection_lost_errors | frozenset((
+    errorcode.CR_CONN_HOST_ERROR,
+    errorcode.CR_CONNECTION_ERROR,
+    errorcode.ER_LOCK_DEADLOCK,
+    errorcode.ER_LOCK_WAIT_TIMEOUT,
+))
+
+
+def _db_error(e):
+    """Convert a MySQL error to an OMPDBError (or OMPDBTransientError)."""
+
+    if e.errno in transient_errors:
+        return OMPDBTransientError(str(e))
+
+    return OMPDBError(str(e))
+
+# Default time (seconds) for which a connection may be idle before
+# we ping the server at the start of a transaction.
+default_ping_interval = 60
+
+
+class OMPMySQLConnection(object):
+    """Wrapper for a single MySQL connection, tracking its health.
+
+    Records how many times the connection has been used, when it was
+    last used and how many consecutive errors have occurred on it.
+    Also counts the number of pings performed (or skipped because
+    the connection had been used recently) and reconnections.
+    """
+
+    def __init__(self, server, user, password, use_unicode,
+                 ping_interval=default_ping_interval):
+        self._connect_args = {
+            'host': server,
+            'user': user,
+            'password': password,
+            'use_unicode': use_unicode,
+            'autocommit': False,
+            # Discard any unread results (e.g. from an abandoned
+            # iteration over an unbuffered cursor) before the next query.
+            'consume_results': True,
+        }
+
+        self.ping_interval = ping_interval
+
+        self.conn = None
+        self.n_use = 0
+        self.n_error = 0
+        self.n_error_consecutive = 0
+        self.n_ping = 0
+        self.n_ping_skipped = 0
+        self.n_reconnect = 0
+        self.last_used = None
+        self.lost = False
+
+        self.connect()
+
+    def connect(self):
+        """Open the underlying connection (closing any previous one)."""
+
+        if self.conn is not None:
+            self.close()
+
+        self.conn = mysql.connector.connect(**self._connect_args)
+        self.n_error_consecutive = 0
+        self.lost = False
+
+    def check_alive(self):
+        """Ensure the connection is alive before starting a transaction.
+
+        The server is only pinged if the connection has been idle
+        for longer than the ping interval, since a dropped connection
+        will otherwise be detected (and re-established) when the first
+        query of the transaction fails.
+        """
+
+        if self.lost:
+            self.reconnect()
+            return
+
+        if (self.last_used is not None
+                and time() - self.last_used <= self.ping_interval):
+            self.n_ping_skipped += 1
+            return
+
+        self.n_ping += 1
+        self.conn.ping(reconnect=True, attempts=1, delay=0)
+
+    def reconnect(self):
+        """Re-establish a connection which has been lost."""
+
+        self.n_reconnect += 1
+        self.conn.reconnect(attempts=1, delay=0)
+        self.lost = False
+
+    def close(self):
+        """Close the underlying connection, ignoring errors."""
+
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+    def mark_used(self, db_error):
+        """Record the outcome of a transaction on this connection.
+
+        The "db_error" argument should indicate whether a database error
+        occurred, rather than any other kind of exception.
+        """
+
+        self.n_use += 1
+        self.last_used = time()
+
+        if db_error:
+            self.n_error += 1
+            self.n_error_consecutive += 1
+        else:
+            self.n_error_consecutive = 0
+
+    def is_healthy(self, max_errors):
+        """Determine whether the connection seems to still be usable.
+
+        A connection is considered unhealthy if the given number
+        of consecutive errors have occurred on it, or if it was lost
+        and could not be re-established.  (This does not contact the
+        server, to avoid adding a round trip to every transaction.)
+        """
+
+        if self.lost:
+            return False
+
+        return self.n_error_consecutive < max_errors
+
+    def get_status(self):
+        """Get a dictionary of information about the connection's health.
+        """
+
+        return {
+            'use': self.n_use,
+            'error': self.n_error,
+            'error_consecutive': self.n_error_consecutive,
+            'ping': self.n_ping,
+            'ping_skipped': self.n_ping_skipped,
+            'reconnect': self.n_reconnect,
+            'last_used': self.last_used,
+        }
+
+
+@contextmanager
+def connection_transaction(connection, read_write=False, instrument=None,
+                           lock_wait=0.0):
+    """Context manager for a transaction on a given connection.
+
+    This provides the cursor handling, commit and rollback logic
+    shared by the OMPMySQLLock and OMPMySQLPool classes.  The caller
+    is responsible for ensuring that the connection is not in use by
+    another thread.
+
+    If the "read_write" parameter is given, then a commit or rollback
+    will be performed depending on whether an error occurs or not.
+    Otherwise the cursor will be patched to try to catch some accidental
+    attempts to peform queries other than selects.
+
+    If the first query of the transaction fails because the connection
+    to the server has been lost, the connection is re-established and
+    the query retried once.  (Later queries are not retried since
+    the earlier part of the transaction would have been lost.)
+
+    If a QueryInstrument is given, the queries are timed and the
+    records passed to it.  The time taken to acquire the connection
+    can be given as lock_wait for inclusion in the first record.
+    """
+
+    conn = connection.conn
+    cursor = None
+    success = False
+    db_error = False
+    timer = None
+
+    if instrument is not None:
+        timer = instrument.start_transaction(lock_wait)
+
+    try:
+        # Make sure we still have an active connection to MySQL.
+        if timer is None:
+            connection.check_alive()
+        else:
+            start = time()
+            connection.check_alive()
+            timer.add_ping(time() - start)
+
+        cursor = conn.cursor()
+
+        # Patch the cursor object's execute method.  For read-only
+        # transactions it checks that the query starts with "SELECT".
+        # This isn't very elegant but there doesn't seem to be an
+        # obvious way in which to get a read-only connection or cursor.
+
+        orig_exec = cursor.execute
+        n_exec = [0]
+
+        def execute_wrapper(that, query, *args, **kwargs):
+            if not (read_write or query.upper().startswith('SELECT')):
+                raise OMPDBError(
+                    'non-select query in read-only transaction')
+
+            n_exec[0] += 1
+
+            if timer is not None:
+                timer.start_query(query)
+                start = time()
+                error = True
+
+            try:
+                try:
+                    result = orig_exec(query, *args, **kwargs)
+
+                except mysql.connector.Error as e:
+                    if e.errno not in connection_lost_errors:
+                        raise
+
+                    connection.lost = True
+
+                    if n_exec[0] > 1:
+                        raise
+
+                    connection.reconnect()
+
+                    result = orig_exec(query, *args, **kwargs)
+
+                error = False
+                return result
+
+            finally:
+                if timer is not None:
+                    timer.add_execute(time() - start, error)
+
+        cursor.execute = MethodType(execute_wrapper, cursor)
+
+        if timer is not None:
+            _patch_fetch_methods(cursor, timer)
+
+        yield cursor
+
+        if read_write:
+            conn.commit()
+
+    except mysql.connector.Error as e:
+        # If we got a database-specific error, re-raise it as our
+        # generic error.  Let other exceptions through unchanged.
+        # Sybase appears to need us to read the error before
+        # closing the cursor?
+
+        db_error = True
+
+        # If the connection was lost, the server will already have
+        # rolled back the transaction.
+        if read_write and not connection.lost:
+            conn.rollback()
+
+        raise _db_error(e)
+
+    except:
+        # Also rollback in the case any other error, but then re-raise
+        # the exception unchanged.
+
+        if read_write:
+            conn.rollback()
+
+        raise
+
+    else:
+        success = True
+
+    finally:
+        if cursor is not None:
+            try:
+                cursor.close()
+
+            except Exception as e:
+                # Ignore errors trying to close the cursor if we are
+                # handling an exception, because Sybase can get into
+                # a state where we can't close it!
+
+                if success:
+                    raise OMPDBError('Failed to close cursor: ' + str(e))
+
+        connection.mark_used(db_error)
+
+        if timer is not None:
+            timer.finish()
+
+
+def _patch_fetch_methods(cursor, timer):
+    """Patch a cursor's fetch methods to record their timing."""
+
+    def make_wrapper(orig_fetch, count):
+        def fetch_wrapper(that, *args, **kwargs):
+            start = time()
+            result = orig_fetch(*args, **kwargs)
+            timer.add_fetch(time() - start, count(result))
+            return result
+
+        return fetch_wrapper
+
+    for (name, count) in (
+            ('fetchall', len),
+            ('fetchmany', len),
+            ('fetchone', lambda x: 0 if x is None else 1)):
+        setattr(cursor, name, MethodType(
+            make_wrapper(getattr(cursor, name), count), cursor))
+
 
 class OMPMySQLLock:
     """MySQL lock and cursor management class.
@@ -37,26 +359,35 @@ class OMPMySQLLock:
 
     def __init__(
             self, server, user, password,
-            read_only=False, use_unicode=None):
+            read_only=False, use_unicode=None,
+            ping_interval=default_ping_interval, instrument=None):
         """Construct object.
 
         Enabling the read_only option provides some limited protection
         against accidentally writing to the database.  (It prevents
         the transaction method being called with read_write enabled.)
         There doesn't seem to be a way of doing this with DBAPI itself.
+
+        The connection is only pinged at the start of a transaction if
+        it has been idle for more than ping_interval seconds.
+
+        A QueryInstrument (see omp.db.instrument) can be given to record
+        the timing of each query.
         """
 
         if use_unicode is None:
             use_unicode = default_use_unicode
 
         self._read_only = read_only
+        self._instrument = instrument
         self._lock = Lock()
-        self._conn = mysql.connector.connect(
-            host=server,
-            user=user,
-            password=password,
-            use_unicode=use_unicode,
-            autocommit=False)
+        self._connection = OMPMySQLConnection(
+            server, user, password, use_unicode,
+            ping_interval=ping_interval)
+
+    @property
+    def _conn(self):
+        return self._connection.conn
 
     @contextmanager
     def transaction(self, read_write=False):
@@ -64,88 +395,280 @@ class OMPMySQLLock:
 
         Acquires the lock and provides a cursor.
 
-        If the "read_write" parameter is given, then a commit or rollback
-        will be performed depending on whether an error occurs or not.
-        Otherwise the cursor will be patched to try to catch some accidental
-        attempts to peform queries other than selects.
+        See the connection_transaction function for details of
+        the "read_write" parameter.
         """
 
         if read_write and self._read_only:
             raise OMPDBError(
                 'attempt to open read_write transaction on read_only object')
 
-        cursor = None
-        success = False
+        start = time()
 
-        try:
-            self._lock.acquire(True)
+        with self._lock:
+            with connection_transaction(
+                    self._connection, read_write,
+                    instrument=self._instrument,
+                    lock_wait=(time() - start)) as cursor:
+                yield cursor
 
-            # Make sure we still have an active connection to MySQL.
-            self._conn.ping(reconnect=True, attempts=3, delay=5)
+    def get_status(self):
+        """Get a list of connection health information dictionaries."""
 
-            cursor = self._conn.cursor()
+        return [self._connection.get_status()]
 
-            if not read_write:
-                # Patch the cursor object so that its execute method checks
-                # that the query starts with "SELECT".  This isn't very
-                # elegant but there doesn't seem to be an obvious way in
-                # which to get a read-only connection or cursor.
+    def get_stats(self):
+        """Get a dictionary of ping and reconnection counts."""
 
-                orig_exec = cursor.execute
+        return _connection_stats([self._connection])
 
-                def read_only_wrapper(that, query, *args):
-                    if not query.upper().startswith('SELECT'):
-                        raise OMPDBError(
-                            'non-select query in read-only transaction')
+    def close(self):
+        """Close the database connection."""
 
-                    return orig_exec(query, *args)
+        self._conn.close()
 
-                cursor.execute = MethodType(read_only_wrapper, cursor)
 
-            yield cursor
+class OMPMySQLPool(object):
+    """MySQL connection pool and cursor management class.
 
-            if read_write:
-                self._conn.commit()
+    This provides the same "transaction" method as OMPMySQLLock but
+    maintains a number of connections so that multiple threads can
+    perform transactions at the same time.  Connections are opened
+    as they are first required, up to the given pool size.
+    """
 
-        except mysql.connector.Error as e:
-            # If we got a database-specific error, re-raise it as our
-            # generic error.  Let other exceptions through unchanged.
-            # Sybase appears to need us to read the error before
-            # closing the cursor?
+    def __init__(
+            self, server, user, password,
+            read_only=False, use_unicode=None,
+            pool_size=4, checkout_timeout=30, checkin_timeout=30,
+            max_errors=3, ping_interval=default_ping_interval,
+            instrument=None):
+        """Construct object.
 
-            if read_write:
-                self._conn.rollback()
+        :param pool_size: maximum number of connections to open.
+        :param checkout_timeout: time (seconds) to wait for a connection
+            to become available before raising an error, or None to
+            wait indefinitely.
+        :param checkin_timeout: time (seconds) for which the close method
+            waits for connections in use to be returned to the pool.
+        :param max_errors: number of consecutive errors after which
+            a connection is discarded when it is returned to the pool.
+        :param ping_interval: idle time (seconds) after which a connection
+            is pinged before use.
+
+        The read_only and instrument options behave as for OMPMySQLLock.
+        """
 
-            raise OMPDBError(str(e))
+        if use_unicode is None:
+            use_unicode = default_use_unicode
 
-        except:
-            # Also rollback in the case any other error, but then re-raise
-            # the exception unchanged.
+        if pool_size < 1:
+            raise OMPDBError('connection pool size must be at least 1')
 
-            if read_write:
-                self._conn.rollback()
+        self._read_only = read_only
+        self._connect_args = (server, user, password, use_unicode)
+        self._pool_size = pool_size
+        self._checkout_timeout = checkout_timeout
+        self._checkin_timeout = checkin_timeout
+        self._max_errors = max_errors
+        self._ping_interval = ping_interval
+        self._instrument = instrument
+
+        self._cond = Condition(Lock())
+        self._idle = []
+        self._connections = set()
+        self._discarded_stats = _connection_stats([])
+        self._n_open = 0
+        self._n_discarded = 0
+        self._closed = False
 
-            raise
+    @contextmanager
+    def transaction(self, read_write=False):
+        """Context manager for database transactions.
 
-        else:
-            success = True
+        Checks out a connection from the pool and provides a cursor.
+
+        See the connection_transaction function for details of
+        the "read_write" parameter.
+        """
+
+        if read_write and self._read_only:
+            raise OMPDBError(
+                'attempt to open read_write transaction on read_only object')
+
+        start = time()
+        connection = self._checkout()
+
+        try:
+            with connection_transaction(
+                    connection, read_write,
+                    instrument=self._instrument,
+                    lock_wait=(time() - start)) as cursor:
+                yield cursor
 
         finally:
-            if cursor is not None:
-                try:
-                    cursor.close()
+            self._checkin(connection)
 
-                except Exception as e:
-                    # Ignore errors trying to close the cursor if we are
-                    # handling an exception, because Sybase can get into
-                    # a state where we can't close it!
+    def _checkout(self):
+        """Get a connection from the pool, opening one if necessary.
 
-                    if success:
-                        raise OMPDBError('Failed to close cursor: ' + str(e))
+        Raises OMPDBError if no connection becomes available within
+        the checkout timeout.
+        """
+
+        deadline = None
+        if self._checkout_timeout is not None:
+            deadline = time() + self._checkout_timeout
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise OMPDBError('connection pool has been closed')
+
+                if self._idle:
+                    return self._idle.pop()
+
+                if self._n_open < self._pool_size:
+                    # Reserve the slot before releasing the lock to
+                    # open the connection.
+                    self._n_open += 1
+                    break
+
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        raise OMPDBError(
+                            'timed out waiting for a database connection')
+                    self._cond.wait(remaining)
+
+        try:
+            connection = OMPMySQLConnection(
+                *self._connect_args, ping_interval=self._ping_interval)
+
+        except mysql.connector.Error as e:
+            with self._cond:
+                self._n_open -= 1
+                self._cond.notify()
 
-            self._lock.release()
+            raise _db_error(e)
+
+        with self._cond:
+            self._connections.add(connection)
+
+        return connection
+
+    def _checkin(self, connection):
+        """Return a connection to the pool.
+
+        Connections which no longer appear to be healthy are closed
+        and their slot in the pool released, so that a fresh connection
+        will be opened when next required.
+        """
+
+        healthy = (not self._closed) and connection.is_healthy(
+            self._max_errors)
+
+        if not healthy:
+            connection.close()
+
+        with self._cond:
+            if healthy:
+                self._idle.append(connection)
+            else:
+                self._discard(connection)
+                if not self._closed:
+                    self._n_discarded += 1
+
+            self._cond.notify_all()
+
+    def get_status(self):
+        """Get a dictionary of information about the pool.
+
+        Includes the number of open connections, the number currently
+        checked out, the number discarded as unhealthy, and a list
+        of health information for each idle connection.
+        """
+
+        with self._cond:
+            return {
+                'size': self._pool_size,
+                'open': self._n_open,
+                'in_use': self._n_open - len(self._idle),
+                'discarded': self._n_discarded,
+                'idle': [x.get_status() for x in self._idle],
+            }
+
+    def get_stats(self):
+        """Get a dictionary of ping and reconnection counts.
+
+        These are totals for all connections opened by the pool,
+        including those which have since been discarded.
+        """
+
+        with self._cond:
+            stats = _connection_stats(self._connections)
+
+            for (key, value) in self._discarded_stats.items():
+                stats[key] += value
+
+        return stats
+
+    def _discard(self, connection):
+        """Remove a connection from the pool's records.
+
+        Must be called with the pool's lock held.
+        """
+
+        self._n_open -= 1
+        self._connections.discard(connection)
+
+        for (key, value) in _connection_stats([connection]).items():
+            self._discarded_stats[key] += value
 
     def close(self):
-        """Close the database connection."""
+        """Close all of the database connections.
 
-        self._conn.close()
+        Waits (up to the checkin timeout) for connections currently
+        in use to be returned to the pool.
+        """
+
+        deadline = time() + self._checkin_timeout
+
+        with self._cond:
+            self._closed = True
+
+            while len(self._idle) < self._n_open:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            idle = self._idle
+            self._idle = []
+
+            for connection in idle:
+                self._discard(connection)
+
+        for connection in idle:
+            connection.close()
+
+
+def _connection_stats(connections):
+    """Sum the usage counters of the given connections."""
+
+    stats = {
+        'use': 0,
+        'ping': 0,
+        'ping_skipped': 0,
+        'reconnect': 0,
+    }
+
+    for connection in connections:
+        stats['use'] += connection.n_use
+        stats['ping'] += connection.n_ping
+        stats['ping_skipped'] += connection.n_ping_skipped
+        stats['reconnect'] += connection.n_reconnect
+
+    return stats
@@ -0,0 +1,197 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from collections import namedtuple, OrderedDict
+from copy import deepcopy
+from functools import wraps
+from threading import Lock
+from time import time
+
+CacheEntry = namedtuple('CacheEntry', ('expiry', 'project', 'value'))
+
+# Default time (seconds) for which cached results remain valid.
+default_ttl = 300
+
+# Default maximum number of entries to hold.
+default_max_entries = 1000
+
+
+class OMPDBCache(object):
+    """In-process cache of OMPDB query results.
+
+    Entries are keyed on the method name and arguments.  Each method
+    can be given its own time-to-live via the ttl dictionary, otherwise
+    the default_ttl is used.  When more than max_entries results are held,
+    the least recently used entries are discarded.
+
+    An instance of this class can be passed to the OMPDB constructor
+    as its "cache" argument, in which case methods marked with the
+    `cached_method` decorator will use it.
+    """
+
+    def __init__(self, ttl=None, default_ttl=default_ttl,
+                 max_entries=default_max_entries):
+        self.ttl = {} if ttl is None else dict(ttl)
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+        self.n_hit = 0
+        self.n_miss = 0
+
+    def get(self, key):
+        """Retrieve an entry from the cache.
+
+        Returns a (found, value) tuple.
+        """
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None or entry.expiry < time():
+                self.n_miss += 1
+                return (False, None)
+
+            # Re-insert the entry to mark it as most recently used.
+            self._entries[key] = entry
+            self.n_hit += 1
+            return (True, deepcopy(entry.value))
+
+    def set(self, key, value, project=None):
+        """Store an entry in the cache.
+
+        The key must be a tuple starting with the method name.  The
+        project code to which the entry applies can be given, allowing
+        the entry to be invalidated selectively.  Entries without
+        a project code are assumed to concern all projects.
+        Project codes are compared case-insensitively, as in the database.
+
+        A (deep) copy of the value is stored, and copies are returned
+        by the get method, so that callers may modify the results.
+        """
+
+        ttl = self.ttl.get(key[0], self.default_ttl)
+
+        if not ttl:
+            return
+
+        if project is not None:
+            project = project.upper()
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = CacheEntry(
+                time() + ttl, project, deepcopy(value))
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, method=None, projects=None):
+        """Remove entries from the cache.
+
+        If a method name is given, only entries for that method are
+        removed.  If a list of project codes is given, only entries
+        relating to those projects (or to no specific project)
+        are removed.  With no arguments, the whole cache is cleared.
+        """
+
+        if projects is not None:
+            projects = set(x.upper() for x in projects)
+
+        with self._lock:
+            for (key, entry) in list(self._entries.items()):
+                if method is not None and key[0] != method:
+                    continue
+
+                if (projects is not None and entry.project is not None
+                        and entry.project not in projects):
+                    continue
+
+                del self._entries[key]
+
+    def get_stats(self):
+        """Get a dictionary of cache statistics."""
+
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hit': self.n_hit,
+                'miss': self.n_miss,
+            }
+
+
+def cached_method(project_arg=None):
+    """Decorator for OMPDB methods whose results may be cached.
+
+    If the object has a cache, the result is looked up by method name
+    and arguments before querying the database.  Calls with
+    unhashable arguments bypass the cache.
+
+    The name of the argument giving the project code may be specified,
+    to allow entries to be invalidated by project.  Project codes
+    containing SQL pattern characters are treated as applying
+    to all projects.
+    """
+
+    def decorator(function):
+        name = function.__name__
+        code = function.__code__
+        arg_names = code.co_varnames[1:code.co_argcount]
+
+        @wraps(function)
+        def wrapper(self, *args, **kwargs):
+            cache = self.cache
+
+            if cache is None:
+                return function(self, *args, **kwargs)
+
+            key = (name, args, tuple(sorted(kwargs.items())))
+
+            try:
+                hash(key)
+            except TypeError:
+                return function(self, *args, **kwargs)
+
+            (found, value) = cache.get(key)
+
+            if found:
+                return value
+
+            value = function(self, *args, **kwargs)
+
+            project = None
+            if project_arg is not None:
+                if project_arg in kwargs:
+                    project = kwargs[project_arg]
+                else:
+                    index = arg_names.index(project_arg)
+                    if index < len(args):
+                        project = args[index]
+
+                if project is not None and (
+                        '%' in project or '_' in project):
+                    project = None
+
+            cache.set(key, value, project=project)
+
+            return value
+
+        return wrapper
+
+    return decorator
@@ -18,30 +18,233 @@ from __future__ import print_function, division, absolute_import
 
 from collections import namedtuple, OrderedDict
 from datetime import datetime
+from itertools import groupby
 from keyword import iskeyword
+from time import time
 
 from pytz import UTC
 
-from omp.db.backend.mysql import OMPMySQLLock
+from omp.db.arrays import fetch_arrays
+from omp.db.backend.mysql import OMPMySQLLock, OMPMySQLPool
+from omp.db.cache import cached_method
 from omp.error import OMPDBError
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Maximum number of values to include in an "IN (...)" list.
+query_chunk_size = 1000
+
+# Number of rows to fetch at a time when iterating over query results.
+fetch_batch_size = 1000
+
+# Overlaps applied to the marks of incremental ingestion polls, to allow
+# for rows committed later than others with greater values.
+ingestion_overlap_minutes = 10
+ingestion_overlap_obslogid = 100
+
+# Cache of row classes, by name and field list.
+_row_types = {}
+
+
+def _chunked(values, size):
+    """Generate lists of at most the given size from an iterable,
+    omitting duplicated values.
+    """
+
+    seen = set()
+    chunk = []
+
+    for value in values:
+        if value in seen:
+            continue
+
+        seen.add(value)
+        chunk.append(value)
+
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+QueryPlan = namedtuple('QueryPlan', ('queries', 'process'))
+
+QueryResult = namedtuple('QueryResult', ('rows', 'description'))
+
+PartTiming = namedtuple('PartTiming', ('query', 'process'))
+
+# Parts available via OMPDB.get_project_bundle, with the name of
+# the corresponding query plan method.
+project_bundle_parts = OrderedDict((
+    ('project_info', '_plan_project_info'),
+    ('remaining_msb_info', '_plan_remaining_msb_info'),
+    ('time_charged', '_plan_time_charged_project_info'),
+    ('fault_summary', '_plan_fault_summary'),
+    ('acsis_info', '_plan_acsis_info'),
+    ('observations', '_plan_observations_from_project'),
+))
+
+ProjectBundle = namedtuple(
+    'ProjectBundle',
+    ['projectcode'] + list(project_bundle_parts.keys()) + ['timing'])
+
+
+def _fetch_plan(cursor, plan):
+    """Execute the queries of a QueryPlan.
+
+    Returns a list of QueryResult tuples, one per query, for
+    passing to the plan's process function.
+    """
+
+    results = []
+
+    for (query, args) in plan.queries:
+        cursor.execute(query, args)
+        rows = cursor.fetchall()
+        results.append(QueryResult(rows, cursor.description))
+
+    return results
+
+
+def _group_rows(rows, row_type, sorted_rows=False):
+    """Group rows by their first column.
+
+    Each row is converted to the given row type, omitting the first
+    column.  By default all the rows are read and an OrderedDict of lists
+    is returned, by group, in order of first appearance.
+
+    If sorted_rows is specified, the rows must already be ordered by
+    the first column.  A generator is then returned which yields
+    (group, list) tuples as each group is completed, so that the rows
+    can be streamed from the database.
+    """
+
+    if sorted_rows:
+        return (
+            (key, [row_type(*row[1:]) for row in group])
+            for (key, group) in groupby(rows, key=lambda x: x[0]))
+
+    result = OrderedDict()
+
+    for row in rows:
+        key = row[0]
+        group = result.get(key)
+
+        if group is None:
+            group = result[key] = []
+
+        group.append(row_type(*row[1:]))
+
+    return result
+
+
+def _row_type(name, fields):
+    """Get a namedtuple class for rows with the given name and fields.
+
+    Classes are created on first use and then cached by name and field
+    list, so that they are not redefined on every query.  (Being
+    namedtuples, their instances have empty __slots__ and so do not
+    carry a per-row attribute dictionary.)
+    """
+
+    if isinstance(fields, str):
+        fields = fields.replace(',', ' ').split()
+
+    key = (name, tuple(fields))
+
+    row_type = _row_types.get(key)
+
+    if row_type is None:
+        row_type = _row_types.setdefault(key, namedtuple(name, fields))
+
+    return row_type
+
+
+def _row_type_from_description(name, description):
+    """Get a namedtuple class for rows matching a cursor description.
+
+    Column names which are Python keywords have an underscore appended.
+    """
+
+    return _row_type(
+        name,
+        ['{0}_'.format(x[0]) if iskeyword(x[0]) else x[0]
+         for x in description])
+
+
+def _in_params(prefix, values, args):
+    """Prepare parameters for an "IN (...)" list.
+
+    Adds the values to the args dictionary, with names made from the
+    given prefix, and returns the comma-separated placeholders.
+    """
+
+    params = []
+
+    for (i, value) in enumerate(values):
+        param = '{}{}'.format(prefix, i)
+        args[param] = value
+        params.append('%({})s'.format(param))
+
+    return ', '.join(params)
+
+
+class IngestionPollState(object):
+    """High-water marks for incremental ingestion polling.
+
+    An instance of this class can be passed to
+    OMPDB.find_obs_for_ingestion to have it remember how far the
+    previous poll got, so that the next poll need only consider
+    observations which could have changed since then.
+
+    The marks are stored with an overlap: observations modified up to
+    overlap_minutes before the latest last_modified value, and those with
+    comments up to overlap_obslogid entries before the latest, are
+    considered again by the next poll.  This is so that rows whose
+    transactions were committed after the marks were read are not missed.
+    """
+
+    def __init__(self, overlap_minutes=ingestion_overlap_minutes,
+                 overlap_obslogid=ingestion_overlap_obslogid):
+        self.overlap_minutes = overlap_minutes
+        self.overlap_obslogid = overlap_obslogid
+        self.reset()
+
+    def reset(self):
+        """Clear the marks so that the next poll is a full rescan."""
+
+        self.last_modified = None
+        self.obslogid = None
+        self.pending = set()
+
+    def is_initialized(self):
+        """Determine whether a poll has been performed."""
+
+        return self.last_modified is not None
+
 
 class OMPDB:
     """OMP and JCMT database access class.
     """
 
-    CommonInfo = None
-    FullObservationInfo = None
-    FaultInfo = None
+    cache = None
 
-    def __init__(self, dev=False, **kwargs):
+    def __init__(self, dev=False, pool_size=None, cache=None, **kwargs):
         """Construct new OMP and JCMT database object.
 
         Connects to the EAO MySQL server.
 
+        If a pool_size is given, an OMPMySQLPool with that number
+        of connections is used, allowing multiple threads to query
+        the database concurrently.  In this case, additional keyword
+        arguments such as checkout_timeout are passed to the pool.
+        Otherwise a single connection is shared via an OMPMySQLLock.
+
+        An OMPDBCache can be given to cache the results of project-level
+        queries, such as get_project_info.
         """
 
         prefix = ('dev' if dev else '')
@@ -49,7 +252,12 @@ class OMPDB:
         self.jcmt_db = '{}jcmt.'.format(prefix)
         self.omp_db = '{}omp.'.format(prefix)
 
-        self.db = OMPMySQLLock(**kwargs)
+        if pool_size is None:
+            self.db = OMPMySQLLock(**kwargs)
+        else:
+            self.db = OMPMySQLPool(pool_size=pool_size, **kwargs)
+
+        self.cache = cache
 
     def close(self):
         """
@@ -58,6 +266,139 @@ class OMPDB:
 
         self.db.close()
 
+    def _iterate_query(self, query, args, batch_size=fetch_batch_size):
+        """Generate the rows resulting from a query.
+
+        Rows are fetched from the (unbuffered) cursor in batches of the
+        given size, so that the full result set need not be held
+        in memory.  Note that the transaction remains open, and so
+        the connection in use, until the generator is exhausted or closed.
+        The server may also drop the connection if the caller takes
+        longer than its net_write_timeout (60 seconds by default)
+        between batches, so slow consumers should use _iterate_paged
+        instead.
+        """
+
+        with self.db.transaction() as c:
+            c.execute(query, args)
+
+            while True:
+                rows = c.fetchmany(batch_size)
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield row
+
+    def _iterate_paged(self, fields, tables, conditions, args, key,
+                       key_table, key_conditions,
+                       batch_size=fetch_batch_size):
+        """Generate the rows resulting from a query, fetched in pages.
+
+        Each page is read in its own transaction by two queries.  The
+        first selects the next batch_size values of the key column
+        from key_table (which should have an index on it), after the
+        last value of the previous page.  The second then fetches the
+        full rows for that range of key values, so that each page
+        requires only a range scan even when other tables are joined
+        and there may be several rows per key value.  The key must
+        not be NULL.  Unlike _iterate_query, no result set remains
+        open while the caller processes the rows, so the time taken to
+        do so is not limited by the server's net_write_timeout.  (But the
+        pages are not read as a single consistent snapshot.)
+
+        Arguments:
+            fields: list of SQL expressions to select
+            tables: SQL text for the FROM clause
+            conditions: list of SQL conditions
+            args: query parameters
+            key: SQL key column
+            key_table: SQL text for the FROM clause of the key query
+            key_conditions: list of SQL conditions for the key query,
+                which should be those of the conditions applicable
+                to key_table
+
+        Yields the rows, ordered by key.
+        """
+
+        last = None
+
+        while True:
+            page_args = dict(args)
+            page_conditions = list(conditions)
+            page_key_conditions = list(key_conditions)
+
+            if last is not None:
+                page_args['page_start'] = last
+                page_condition = '{}>%(page_start)s'.format(key)
+                page_conditions.append(page_condition)
+                page_key_conditions.append(page_condition)
+
+            key_query = 'SELECT {} FROM {}'.format(key, key_table)
+
+            if page_key_conditions:
+                key_query += ' WHERE ' + ' AND '.join(page_key_conditions)
+
+            key_query += ' ORDER BY {} LIMIT {}'.format(key, int(batch_size))
+
+            with self.db.transaction(read_write=False) as c:
+                c.execute(key_query, page_args)
+                keys = c.fetchall()
+
+                if not keys:
+                    break
+
+                page_args['page_end'] = keys[-1][0]
+                page_conditions.append('{}<=%(page_end)s'.format(key))
+
+                c.execute(
+                    'SELECT ' + ', '.join(fields) + ' FROM ' + tables +
+                    ' WHERE ' + ' AND '.join(page_conditions) +
+                    ' ORDER BY ' + key,
+                    page_args)
+                rows = c.fetchall()
+
+            for row in rows:
+                yield row
+
+            if len(keys) < batch_size:
+                break
+
+            last = page_args['page_end']
+
+    def _read_header_query(self, query, args, date_start=None, date_end=None,
+                           iterate=False, batch_size=fetch_batch_size):
+        """Run a read-only query of the JCMT header tables.
+
+        The UT date range (YYYYMMDD, either end of which may be None
+        if unlimited) to which the query is restricted is given so that
+        subclasses can answer it from a local copy of the tables
+        where possible.
+
+        Returns a list of rows, or if iterate is specified, a generator
+        (as for _iterate_query).
+        """
+
+        if iterate:
+            return self._iterate_query(query, args, batch_size=batch_size)
+
+        with self.db.transaction(read_write=False) as c:
+            c.execute(query, args)
+
+            return c.fetchall()
+
+    def _run_plan(self, plan):
+        """Execute a QueryPlan in a read-only transaction.
+
+        The queries are run in the transaction, but the plan's
+        process function is applied to the results after it ends.
+        """
+
+        with self.db.transaction(read_write=False) as c:
+            results = _fetch_plan(c, plan)
+
+        return plan.process(results)
+
     def get_obsid_common(self, obsid):
         """Retrieve information for a given obsid from the COMMON table.
         """
@@ -76,13 +417,48 @@ class OMPDB:
         elif len(rows) > 1:
             raise OMPDBError('multiple COMMON results for one obsid')
 
-        if self.CommonInfo is None:
-            self.CommonInfo = namedtuple(
-                'CommonInfo',
-                ['{0}_'.format(x[0]) if iskeyword(x[0]) else x[0]
-                 for x in cols])
+        CommonInfo = _row_type_from_description('CommonInfo', cols)
+
+        return CommonInfo(*rows[0])
+
+    def get_obsid_common_many(self, obsids, chunk_size=query_chunk_size):
+        """Retrieve information for multiple obsids from the COMMON table.
+
+        The obsids are queried in chunks of at most the given size,
+        all within one transaction.
+
+        Returns a dictionary of CommonInfo tuples by obsid.  Obsids
+        which are not found are omitted.
+        """
+
+        result = {}
+
+        with self.db.transaction() as c:
+            for chunk in _chunked(obsids, chunk_size):
+                args = {}
+                c.execute(
+                    'SELECT * FROM jcmt.COMMON WHERE obsid IN ({})'.format(
+                        _in_params('o', chunk, args)),
+                    args)
+
+                rows = c.fetchall()
+                cols = c.description
+
+                if not rows:
+                    continue
+
+                CommonInfo = _row_type_from_description('CommonInfo', cols)
+
+                for row in rows:
+                    info = CommonInfo(*row)
 
-        return self.CommonInfo(*rows[0])
+                    if info.obsid in result:
+                        raise OMPDBError(
+                            'multiple COMMON results for one obsid')
+
+                    result[info.obsid] = info
+
+        return result
 
     def get_obsid_status(self, obsid, comment=False):
         """Retrieve the last comment status for a given obsid.
@@ -116,10 +492,108 @@ class OMPDB:
         else:
             return rows[0]
 
+    def get_obsid_status_many(self, obsids, comment=False,
+                              chunk_size=query_chunk_size):
+        """Retrieve the last comment status for multiple obsids.
+
+        The obsids are queried in chunks of at most the given size,
+        all within one transaction.  The latest comment for each obsid
+        in a chunk is found via a single grouped query.
+
+        Returns a dictionary by obsid of the status, or if comment = True,
+        of (status, text, author, date) tuples.  Obsids with no status
+        are omitted.
+        """
+
+        columns = 'o.obsid, o.commentstatus'
+        if comment:
+            columns += ', o.commenttext, o.commentauthor, o.commentdate'
+
+        result = {}
+
+        with self.db.transaction() as c:
+            for chunk in _chunked(obsids, chunk_size):
+                args = {}
+                c.execute(' '.join([
+                    'SELECT {1} FROM {0}ompobslog AS o',
+                    'JOIN (SELECT obsid, MAX(obslogid) AS obslogid',
+                    'FROM {0}ompobslog',
+                    'WHERE obsid IN ({2}) AND obsactive=1',
+                    'GROUP BY obsid) AS l',
+                    'ON o.obslogid=l.obslogid',
+                ]).format(self.omp_db, columns, _in_params('o', chunk, args)),
+                    args)
+
+                for row in c.fetchall():
+                    if row[0] in result:
+                        raise OMPDBError(
+                            'multiple status results for one obsid')
+
+                    result[row[0]] = (row[1:] if comment else row[1])
+
+        return result
+
+    def _latest_obslog_join(self, alias, obsid='c.obsid', active_only=False,
+                            restrict=None, join='LEFT OUTER JOIN'):
+        """Prepare SQL to join the latest ompobslog entry for each observation.
+
+        Rather than using a correlated subquery to find the MAX(obslogid)
+        for each observation, which MySQL evaluates once per row,
+        the latest entry for every obsid is found via a single grouped
+        derived table.
+
+        Arguments:
+            alias: alias to give the ompobslog table
+            obsid: column giving the obsid for which to find the entry
+            active_only: only consider entries with obsactive=1
+            restrict: additional SQL condition (on obsid) to limit
+                      the size of the derived table
+            join: type of join to use
+
+        Returns:
+            SQL text to follow the table in the FROM clause.
+        """
+
+        where = []
+        if active_only:
+            where.append('obsactive=1')
+        if restrict is not None:
+            where.append(restrict)
+
+        latest = '{}_latest'.format(alias)
+
+        return ' '.join([
+            join,
+            '(SELECT obsid, MAX(obslogid) AS obslogid FROM omp.ompobslog',
+            ('WHERE ' + ' AND '.join(where)) if where else '',
+            'GROUP BY obsid) AS {0}'.format(latest),
+            'ON {0}.obsid={1}'.format(latest, obsid),
+            join,
+            'omp.ompobslog AS {0}'.format(alias),
+            'ON {0}.obslogid={1}.obslogid '.format(alias, latest),
+        ])
+
+    def _common_restrict(self, conditions):
+        """Prepare a restriction for _latest_obslog_join.
+
+        The conditions (on the jcmt.COMMON table, without table alias)
+        are used to select the obsids for which ompobslog entries
+        are required.  Returns None if there are no conditions.
+        """
+
+        conditions = [x.strip() for x in conditions if x.strip()]
+
+        if not conditions:
+            return None
+
+        return 'obsid IN (SELECT obsid FROM jcmt.COMMON WHERE {})'.format(
+            ' AND '.join(conditions))
+
     def find_obs_for_ingestion(self, utdate_start, utdate_end=None,
                                no_status_check=False, no_transfer_check=False,
                                ignore_instruments=None,
-                               min_age_hours=4):
+                               min_age_hours=4,
+                               poll_state=None, full_rescan=False):
         """Find (raw) observations which are due for ingestion into CAOM-2.
 
         This method searches for observations matching these criteria:
@@ -142,6 +616,25 @@ class OMPDB:
             no_transfer_check: disable criterion 4
             min_age_hours: alter minimum tine for criterion 2, or None
                            to remove this restriction (default: 4)
+            poll_state: IngestionPollState object for incremental polling
+            full_rescan: ignore the poll_state's marks and consider
+                         the whole date range
+
+        If a poll_state is given, and it has been used for a previous
+        poll (with the same arguments), then only the following
+        observations are considered:
+
+            * those with last_modified at least that of the last poll
+              (less the poll_state's overlap_minutes)
+            * those with ompobslog entries added since the last poll
+              (or within the poll_state's overlap_obslogid entries before)
+            * those which needed ingestion at the last poll (criteria 1
+              and 3), whether or not they were returned.  These are kept
+              until they no longer need ingestion, which covers
+              observations waiting for criteria 2 or 4, and ones whose
+              ingestion did not succeed.
+
+        The poll_state is then updated with the new marks.
 
         Returns:
             A list of OBSID strings.
@@ -164,9 +657,10 @@ class OMPDB:
                 ['"{}"'.format(x) for x in ignore_instruments])))
 
         # Check the observation is finished.  (Started >= 4 hours ago.)
+        ready = []
         if min_age_hours is not None:
             args['ma'] = min_age_hours
-            where.append('(TIMESTAMPDIFF(HOUR, date_obs, UTC_TIMESTAMP()) >= %(ma)s)')
+            ready.append('(TIMESTAMPDIFF(HOUR, date_obs, UTC_TIMESTAMP()) >= %(ma)s)')
 
         # Look for last_caom_mod NULL, older than last_modified
         # or (optionally) comment newer than last_caom_mod.
@@ -183,14 +677,18 @@ class OMPDB:
 
         # Check that all files have been transferred.
         if not no_transfer_check:
-            where.append('(SELECT COUNT(*) FROM jcmt.FILES AS f'
+            ready.append('(SELECT COUNT(*) FROM jcmt.FILES AS f'
                             ' JOIN jcmt.transfer AS t'
                             ' ON f.file_id=t.file_id'
                             ' WHERE f.obsid=c.obsid'
                                 ' AND t.status NOT IN ("t", "d", "D", "z"))'
                             ' = 0')
 
-        query = 'SELECT obsid FROM jcmt.COMMON AS c WHERE ' + ' AND '.join(where)
+        if poll_state is not None:
+            return self._find_obs_for_ingestion_incremental(
+                where, ready, args, poll_state, full_rescan)
+
+        query = 'SELECT obsid FROM jcmt.COMMON AS c WHERE ' + ' AND '.join(where + ready)
         result = []
 
         with self.db.transaction() as c:
@@ -205,6 +703,83 @@ class OMPDB:
 
         return result
 
+    def _find_obs_for_ingestion_incremental(
+            self, where, ready, args, poll_state, full_rescan):
+        """Perform an incremental find_obs_for_ingestion poll.
+
+        The "where" conditions identify observations needing ingestion
+        and the "ready" conditions those which can be ingested now.
+        """
+
+        incremental = poll_state.is_initialized() and not full_rescan
+
+        query = 'SELECT c.obsid, {} FROM jcmt.COMMON AS c WHERE {}'.format(
+            (' AND '.join(ready) if ready else '1'),
+            ' AND '.join(where))
+
+        result = []
+        pending = set()
+
+        def process(c):
+            while True:
+                row = c.fetchone()
+                if row is None:
+                    break
+
+                (obsid, is_ready) = row
+
+                if obsid in pending:
+                    continue
+
+                pending.add(obsid)
+
+                if is_ready:
+                    result.append(obsid)
+
+        with self.db.transaction() as c:
+            # Read the new marks first, so that anything changed while
+            # we are polling will be considered again next time.  The
+            # overlaps allow for rows not yet committed when they are read.
+            c.execute(
+                'SELECT MAX(last_modified) - INTERVAL %(om)s MINUTE'
+                ' FROM jcmt.COMMON',
+                {'om': poll_state.overlap_minutes})
+            last_modified = c.fetchall()[0][0]
+            c.execute(
+                'SELECT MAX(obslogid) - %(oo)s FROM omp.ompobslog',
+                {'oo': poll_state.overlap_obslogid})
+            obslogid = c.fetchall()[0][0]
+
+            if not incremental:
+                c.execute(query, args)
+                process(c)
+
+            else:
+                changed_args = args.copy()
+                changed_args['lm'] = poll_state.last_modified
+                changed_args['ol'] = poll_state.obslogid or 0
+
+                c.execute(
+                    query + ' AND (c.last_modified >= %(lm)s'
+                    ' OR c.obsid IN (SELECT obsid FROM omp.ompobslog'
+                    ' WHERE obslogid > %(ol)s))',
+                    changed_args)
+                process(c)
+
+                for chunk in _chunked(poll_state.pending, query_chunk_size):
+                    chunk_args = args.copy()
+                    c.execute(
+                        query + ' AND c.obsid IN ({})'.format(
+                            _in_params('pending', chunk, chunk_args)),
+                        chunk_args)
+                    process(c)
+
+        poll_state.last_modified = last_modified
+        poll_state.obslogid = obslogid
+        poll_state.pending = pending
+
+        return result
+
     def set_last_caom_mod(self, obsid, set_null=False):
         """Set the "COMMON.last_caom_mod" column to the current date
         and time for the given observation.
@@ -235,6 +810,47 @@ class OMPDB:
             # elif c.rowcount > 1:
             #     raise ExcessRowsError('COMMON', query, args)
 
+    def set_last_caom_mod_many(self, obsids, timestamp=None, set_null=False,
+                               chunk_size=query_chunk_size):
+        """Set the "COMMON.last_caom_mod" column for multiple observations.
+
+        This is a bulk equivalent of `set_last_caom_mod`.  The updates
+        are issued in chunks of at most the given size, all within one
+        transaction.
+
+        If a timestamp is given, it is used instead of the current
+        date and time.  If the set_null option is given then last_caom_mod
+        is nulled instead.
+
+        Returns a list of the number of rows affected by each chunk.
+        """
+
+        if set_null:
+            value = 'NULL'
+        elif timestamp is None:
+            value = 'NOW()'
+        else:
+            value = '%(t)s'
+
+        counts = []
+
+        with self.db.transaction(read_write=True) as c:
+            for chunk in _chunked(obsids, chunk_size):
+                args = {}
+                if timestamp is not None and not set_null:
+                    args['t'] = timestamp
+
+                # Explicitly set last_modified to the existing value to
+                # prevent MySQL from automatically updating it.
+                c.execute(
+                    'UPDATE jcmt.COMMON SET last_caom_mod = ' + value +
+                    ', last_modified = last_modified' +
+                    ' WHERE obsid IN (' + _in_params('o', chunk, args) + ')',
+                    args)
+
+                counts.append(c.rowcount)
+
+        return counts
 
     def find_obs_by_date(self, utstart, utend, instrument=None):
         """
@@ -264,10 +880,8 @@ class OMPDB:
             query += ' AND upper(instrume)=%(i)s'
             args['i'] = instrument.upper()
 
-        with self.db.transaction(read_write=False) as c:
-            c.execute(query, args)
-
-            rows = c.fetchall()
+        rows = self._read_header_query(
+            query, args, date_start=utstart, date_end=utend)
 
         # Reformat output list.
         if rows:
@@ -308,12 +922,8 @@ class OMPDB:
             query += ' AND upper(backend)=%(b)s'
             args['b'] = backend.upper()
 
-        with self.db.transaction(read_write=False) as c:
-            c.execute(query, args)
-
-            rows = c.fetchall()
-
-        return rows
+        return self._read_header_query(
+            query, args, date_start=utstart, date_end=utend)
 
     def get_observations_from_project(self, projectcode,
                                       utdatestart=None, utdateend=None, instrument=None,
@@ -336,14 +946,23 @@ class OMPDB:
 
         """
 
+        return self._run_plan(self._plan_observations_from_project(
+            projectcode, utdatestart, utdateend, instrument, ompstatus))
+
+    def _plan_observations_from_project(
+            self, projectcode, utdatestart=None, utdateend=None,
+            instrument=None, ompstatus=None):
+        """Prepare the query plan for get_observations_from_project."""
+
         query = ("SELECT c.obsid, "
                  "  CASE WHEN c.recipe='REDUCE_POL_SCAN' THEN 'POL-2' ELSE c.instrume END AS instrume, "
                  " c.wvmtaust, c.wvmtauen, c.utdate, c.obsnum, c.object,"
                  " timestampdiff(second, c.date_obs, c.date_end) as time, o.commentstatus, o.commenttext,"
                  " c.req_mintau, c.req_maxtau "
-                 " FROM jcmt.COMMON as c LEFT OUTER JOIN omp.ompobslog as o "
-                 " ON o.obslogid = (SELECT MAX(obslogid) FROM omp.ompobslog o2 WHERE o2.obsid = c.obsid) "
-                 " WHERE project=%(p)s")
+                 " FROM jcmt.COMMON as c "
+                 + self._latest_obslog_join(
+                     'o', restrict='obsid IN (SELECT obsid FROM jcmt.COMMON WHERE project=%(p)s)')
+                 + " WHERE project=%(p)s")
 
         args = {'p': str(projectcode).upper()}
 
@@ -366,16 +985,15 @@ class OMPDB:
         # Order by date.
         query += ' ORDER BY c.utdate ASC '
 
-        projobsinfo = namedtuple('projobsinfo',
+        projobsinfo = _row_type('projobsinfo',
             'obsid instrument wvmtaust wvmtauen utdate obsnum object duration '
             'status commenttext req_mintau req_maxtau')
 
-        # Carry out query
-        with self.db.transaction(read_write=False) as c:
-            c.execute(query, args)
-            rows = c.fetchall()
-            results = OrderedDict( [ [i[0], projobsinfo(*i)] for i in rows] )
-        return results
+        def process(results):
+            return OrderedDict(
+                [[i[0], projobsinfo(*i)] for i in results[0].rows])
+
+        return QueryPlan([(query, args)], process)
 
     def create_group_project_query(self, semester=None, queue=None, projects=None, patternmatch=None, telescope='JCMT'):
         """
@@ -423,7 +1041,7 @@ class OMPDB:
         Return summary information about observations for a group of projects.
         """
 
-        projobsinfo = namedtuple('projobsinfo', 'project instrument band status number totaltime daynight')
+        projobsinfo = _row_type('projobsinfo', 'project instrument band status number totaltime daynight')
         # First select groups of projects
 
         where_clauses = []
@@ -449,6 +1067,8 @@ class OMPDB:
             where_clauses.append(' utdate <= %(dateend)s ')
             args['dateend'] = utdateend
 
+        restrict = self._common_restrict(where_clauses)
+
 
         select_inner = ("SELECT c.project, "
                  "             CASE WHEN c.recipe='REDUCE_POL_SCAN' THEN 'POL-2' ELSE c.instrume "
@@ -474,8 +1094,8 @@ class OMPDB:
                  "                       between 3.5 and 19.5 THEN 'night' "
                  "                  ELSE 'day' "
                  "             END AS daynight "
-                 "      FROM jcmt.COMMON AS c LEFT OUTER JOIN omp.ompobslog AS o "
-                 "      ON o.obslogid = (SELECT MAX(obslogid) FROM omp.ompobslog o2 WHERE o2.obsid = c.obsid) "
+                 "      FROM jcmt.COMMON AS c " + self._latest_obslog_join(
+                     'o', restrict=restrict)
 
              )
 
@@ -496,8 +1116,8 @@ class OMPDB:
                  "                       between 3.5 and 19.5 THEN 'night'"\
                  "                  ELSE 'day' "\
                  "             END AS daynight "
-                 "      FROM jcmt.COMMON AS c LEFT OUTER JOIN omp.ompobslog AS o "
-                 "      ON o.obslogid = (SELECT MAX(obslogid) FROM omp.ompobslog o2 WHERE o2.obsid = c.obsid) "
+                 "      FROM jcmt.COMMON AS c " + self._latest_obslog_join(
+                     'o', restrict=restrict)
 
              )
 
@@ -539,18 +1159,24 @@ class OMPDB:
            is for obs from 03:30AM to 19:30 UT (5:30PM to 9:30AM HST)
 
         """
-        projobsinfo = namedtuple('projobsinfo', 'project instrument band status number totaltime daynight')
+        projobsinfo = _row_type('projobsinfo', 'project instrument band status number totaltime daynight')
 
         args = {}
+        restrict = []
         if projectpattern:
             args['p'] =  projectpattern
+            restrict.append('project LIKE %(p)s' if like else 'project=%(p)s')
         datequery = ''
         if utdatestart:
             datequery += ' AND utdate >= %(s)s '
             args['s'] = utdatestart
+            restrict.append('utdate >= %(s)s')
         if utdateend:
             datequery += ' AND utdate <= %(e)s '
             args['e'] = utdateend
+            restrict.append('utdate <= %(e)s')
+
+        restrict = self._common_restrict(restrict)
 
 
 
@@ -570,8 +1196,8 @@ class OMPDB:
                  "                       between 3.5 and 19.5 THEN 'night' "
                  "                  ELSE 'day' "
                  "             END AS daynight "
-                 "      FROM jcmt.COMMON AS c LEFT OUTER JOIN omp.ompobslog AS o "
-                 "      ON o.obslogid = (SELECT MAX(obslogid) FROM omp.ompobslog o2 WHERE o2.obsid = c.obsid) "
+                 "      FROM jcmt.COMMON AS c " + self._latest_obslog_join(
+                     'o', restrict=restrict)
              )
 
         if csotau:
@@ -591,8 +1217,8 @@ class OMPDB:
                  "                       between 3.5 and 19.5 THEN 'night'"\
                  "                  ELSE 'day' "\
                  "             END AS daynight "
-                 "      FROM jcmt.COMMON AS c LEFT OUTER JOIN omp.ompobslog AS o "
-                 "      ON o.obslogid = (SELECT MAX(obslogid) FROM omp.ompobslog o2 WHERE o2.obsid = c.obsid) "
+                 "      FROM jcmt.COMMON AS c " + self._latest_obslog_join(
+                     'o', restrict=restrict)
 
              )
 
@@ -650,7 +1276,7 @@ class OMPDB:
                 projectselect += ["o.projectid like %(pattern)s"]
                 args['pattern'] = patternmatch
             projectselect = ' AND ' .join(projectselect)
-        projmsbinfo = namedtuple('projmsbinfo', 'project uniqmsbs totalmsbs totaltime taumin taumax')
+        projmsbinfo = _row_type('projmsbinfo', 'project uniqmsbs totalmsbs totaltime taumin taumax')
         query = ("SELECT o.projectid, count(*), sum(o.remaining), "\
                  "       sum(o.timeest*o.remaining), o.taumin, o.taumax "\
                  "FROM omp.ompmsb as o ")
@@ -676,7 +1302,13 @@ class OMPDB:
         summary for one tau range for one project that matches the projectpattern.
 
         """
-        projmsbinfo = namedtuple('projmsbinfo', 'project uniqmsbs totalmsbs totaltime taumin taumax')
+
+        return self._run_plan(self._plan_summary_msb_info(projectpattern))
+
+    def _plan_summary_msb_info(self, projectpattern):
+        """Prepare the query plan for get_summary_msb_info."""
+
+        projmsbinfo = _row_type('projmsbinfo', 'project uniqmsbs totalmsbs totaltime taumin taumax')
 
         query = ("SELECT o.projectid, count(*), sum(o.remaining), "\
                  "       sum(o.timeest*o.remaining), o.taumin, o.taumax "\
@@ -687,15 +1319,14 @@ class OMPDB:
 
         args = {'p': projectpattern}
 
-        with self.db.transaction(read_write=False) as c:
-            c.execute(query, args)
-            rows = c.fetchall()
-            results = [projmsbinfo(*i) for i in rows]
+        def process(results):
+            return [projmsbinfo(*i) for i in results[0].rows]
 
-        return results
+        return QueryPlan([(query, args)], process)
 
     def get_time_charged_group(self, semester=None, queue=None, projects=None,
-                               patternmatch=None, telescope='JCMT', start=None, end=None):
+                               patternmatch=None, telescope='JCMT', start=None, end=None,
+                               iterate=False):
         """
         Return time charged per day by project.
 
@@ -704,6 +1335,9 @@ class OMPDB:
         Returns Dictionary, key being a project code, value being a
         list of namedtuples, orderd by Dated.
 
+        If the iterate option is specified, the results are ordered
+        by project and a generator of (project, list) tuples is returned
+        instead, streaming the rows from the database.
         """
         query = ("SELECT t.projectid, t.date, t.timespent, t.confirmed, t.shifttype FROM omp.omptimeacct AS  t "
                  " LEFT JOIN omp.ompproj AS p ON t.projectid=p.projectid "
@@ -740,24 +1374,21 @@ class OMPDB:
 
         query += " WHERE " + " AND ".join(wherequery)
 
-        query += " ORDER BY t.date ASC "
+        timeinfo = _row_type('timeinfo', 'date timespent confirmed shifttype')
+
+        if iterate:
+            query += " ORDER BY t.projectid ASC, t.date ASC "
+
+            return _group_rows(
+                self._iterate_query(query, args), timeinfo, sorted_rows=True)
 
-        timeinfo = namedtuple('timeinfo', 'date timespent confirmed shifttype')
+        query += " ORDER BY t.date ASC "
 
         with self.db.transaction(read_write=False) as c:
             c.execute(query, args)
             rows = c.fetchall()
 
-        # Sort out the rows
-        projects = set([i[0] for i in rows])
-        results = {}
-        for r in rows:
-            p = r[0]
-            vals = r[1:]
-            info  = timeinfo( *vals )
-            results[p] = results.get(p, []) + [info]
-
-        return results
+        return _group_rows(rows, timeinfo)
 
     def get_time_charged_project_info(self, projectcode):
         """
@@ -766,17 +1397,20 @@ class OMPDB:
         Returns list of namedtuples, ordered by date.
         """
 
+        return self._run_plan(self._plan_time_charged_project_info(projectcode))
+
+    def _plan_time_charged_project_info(self, projectcode):
+        """Prepare the query plan for get_time_charged_project_info."""
+
         query = "SELECT date, timespent, confirmed from omp.omptimeacct WHERE projectid=%(p)s ORDER BY date ASC"
         args = {'p': projectcode}
 
-        timeinfo = namedtuple('timeinfo', 'date timespent confirmed')
+        timeinfo = _row_type('timeinfo', 'date timespent confirmed')
 
-        # Carry out query
-        with self.db.transaction(read_write=False) as c:
-            c.execute(query, args)
-            rows = c.fetchall()
-            results = [timeinfo(*i) for i in rows]
-        return results
+        def process(results):
+            return [timeinfo(*i) for i in results[0].rows]
+
+        return QueryPlan([(query, args)], process)
 
     def get_fault_summary_dates(self, start=None, end=None):
         """
@@ -804,13 +1438,9 @@ class OMPDB:
         if not rows:
             return None
 
-        if self.FaultInfo is None:
-            self.FaultInfo = namedtuple(
-                'FaultInfo',
-                ['{0}_'.format(x[0]) if iskeyword(x[0]) else x[0]
-                 for x in cols])
+        FaultInfo = _row_type_from_description('FaultInfo', cols)
 
-        return [self.FaultInfo(*i) for i in rows]
+        return [FaultInfo(*i) for i in rows]
 
 
     def get_fault_summary_group(self, semester=None, queue=None, projects=None, patternmatch=None):
@@ -845,7 +1475,7 @@ class OMPDB:
         if projectselect:
             query += " WHERE {}".format(projectselect)
 
-        faultinfo = namedtuple('faultinfo', 'project faultid status subject')
+        faultinfo = _row_type('faultinfo', 'project faultid status subject')
         with self.db.transaction(read_write=False) as c:
             c.execute(query, args)
             rows = c.fetchall()
@@ -865,24 +1495,30 @@ class OMPDB:
         Returns a list of namedtuples.
 
         """
+
+        return self._run_plan(self._plan_fault_summary(projectpattern))
+
+    def _plan_fault_summary(self, projectpattern):
+        """Prepare the query plan for get_fault_summary."""
+
         query = ("SELECT a.projectid, f.faultid, f.status, f.subject "\
                  "FROM omp.ompfaultassoc as a JOIN omp.ompfault as f "\
                  "ON a.faultid = f.faultid "\
                  "WHERE a.projectid LIKE %(p)s")
         args = {'p': projectpattern.lower()}
-        faultinfo = namedtuple('faultinfo', 'project faultid status subject')
-        with self.db.transaction(read_write=False) as c:
-            c.execute(query, args)
-            rows = c.fetchall()
-            results = [faultinfo(*i) for i in rows]
-        return results
+        faultinfo = _row_type('faultinfo', 'project faultid status subject')
+
+        def process(results):
+            return [faultinfo(*i) for i in results[0].rows]
+
+        return QueryPlan([(query, args)], process)
 
     def get_allocations(self, semester=None, queue=None, projects=None, patternmatch=None, telescope='JCMT'):
         """
         Return allocation information for a group of projects.
 
         """
-        allocinfo = namedtuple('allocinfo',
+        allocinfo = _row_type('allocinfo',
                                'pi title semester allocated remaining pending taumin taumax priority enabled')
 
         selectstatement, fromstatement, wherequery, args = self.create_group_project_query(
@@ -903,6 +1539,7 @@ class OMPDB:
             results = OrderedDict([[i[0], allocinfo(*i[1:])] for i in rows])
         return results
 
+    @cached_method(project_arg='projectcode')
     def get_allocation_project(self, projectcode, like=None):
         """
         Get allocation info for a project.
@@ -915,7 +1552,7 @@ class OMPDB:
 
         """
 
-        allocinfo = namedtuple('allocinfo', 'pi title semester allocated remaining pending taumin taumax')
+        allocinfo = _row_type('allocinfo', 'pi title semester allocated remaining pending taumin taumax')
 
         query = ("SELECT projectid, pi, title, semester, allocated, remaining, pending, taumin, taumax"
                  " FROM omp.ompproj")
@@ -936,6 +1573,7 @@ class OMPDB:
 
         return results
 
+    @cached_method()
     def get_cadcusers_and_projects(self, telescope='JCMT', ignoresemesters=None):
         """
         Get COI and PI cadcusernames for all projects.
@@ -947,7 +1585,7 @@ class OMPDB:
 
         """
 
-        projectuser = namedtuple('projectuser', 'project cadcuser capacity')
+        projectuser = _row_type('projectuser', 'project cadcuser capacity')
 
         subquery = " SELECT projectid from omp.ompproj WHERE telescope=%(t)s "
         args = {'t': telescope}
@@ -970,6 +1608,7 @@ class OMPDB:
             results = [projectuser(*i) for i in rows]
         return results
 
+    @cached_method()
     def get_projectids(self, semester, telescope='JCMT'):
         """
         Get all the projects from the OMP for a given semester and telescope.
@@ -1030,6 +1669,9 @@ class OMPDB:
                     'UPDATE omp.{} SET projectid=%(n)s WHERE projectid=%(o)s'.format(table),
                     {'n': project_new, 'o': project_old})
 
+        if self.cache is not None:
+            self.cache.invalidate(projects=[project_old, project_new])
+
 
     def get_support_projects(self, userid, semester):
         """
@@ -1053,7 +1695,7 @@ class OMPDB:
 
         Return a list of namedtuples with project, semester and country and tagpriority
         """
-        projinfo = namedtuple('projinfo', 'project semester country tagpriority')
+        projinfo = _row_type('projinfo', 'project semester country tagpriority')
 
         query = ("SELECT p.projectid, p.semester, q.country, q.tagpriority "
                  "FROM omp.ompproj AS p JOIN omp.ompprojqueue AS q ON p.projectid=q.projectid "
@@ -1074,22 +1716,30 @@ class OMPDB:
     def get_acsis_info(self, projectcode):
         """
         """
+
+        return self._run_plan(self._plan_acsis_info(projectcode))
+
+    def _plan_acsis_info(self, projectcode):
+        """Prepare the query plan for get_acsis_info."""
+
         query = ("SELECT obsid, molecule, transiti, bwmode, subsysnr, doppler, zsource, restfreq "
                  " FROM jcmt.ACSIS WHERE obsid in (SELECT obsid from jcmt.COMMON where project=%(p)s)")
         args = {'p': projectcode}
-        acsisInfo = namedtuple('acsisInfo', "obsid, molecule transition bwmode subsysnr doppler zsource restfreq")
-        with self.db.transaction(read_write=False) as c:
-            c.execute(query, args)
-            values = c.fetchall()
-        if not values:
-            return None
-        else:
-            return [acsisInfo(*i) for i in values]
+        acsisInfo = _row_type('acsisInfo', "obsid, molecule transition bwmode subsysnr doppler zsource restfreq")
+
+        def process(results):
+            values = results[0].rows
+            if not values:
+                return None
+            else:
+                return [acsisInfo(*i) for i in values]
+
+        return QueryPlan([(query, args)], process)
 
     def get_observations(
             self, projectcode,
             utdatestart=None, utdateend=None, instrument=None, ompstatus=None,
-            with_file=False, with_rxh3=False):
+            with_file=False, with_rxh3=False, as_arrays=False):
         """Get a project's observations, optionally limited by date/status.
 
         Returns a NamedTuple object containing everything from the
@@ -1111,32 +1761,39 @@ class OMPDB:
            utdatestart, int: YYYYMMDD Only include obs with obsid on or after this date
            utdateend, int: YYYYMMDD Only include obs taken on or before this date.
            instrument, str:  instrument
+           as_arrays, bool: return a dictionary of NumPy masked arrays
+              by column name (see omp.db.arrays.fetch_arrays) instead
+              of a list of NamedTuples
 
         """
         query = ("SELECT c.*, "
                  " CASE WHEN p.commentstatus is NULL THEN 0 ELSE p.commentstatus END AS commentstatus, "
                  " p.commenttext, p.commentauthor, p.commentdate")
-        query_from = ("jcmt.COMMON AS c LEFT OUTER JOIN omp.ompobslog AS p "
-                 " ON p.obslogid = (SELECT MAX(obslogid) FROM omp.ompobslog p2 WHERE p2.obsid = c.obsid AND obsactive=1)")
-
         where = []
         args = {}
 
         if projectcode is not None:
-            where.append('c.project=%(p)s')
+            where.append('project=%(p)s')
             args['p'] = projectcode
 
         if utdatestart:
-            where.append('c.utdate >= %(s)s')
+            where.append('utdate >= %(s)s')
             args['s'] = utdatestart
         if utdateend:
-            where.append('c.utdate <= %(e)s')
+            where.append('utdate <= %(e)s')
             args['e'] = utdateend
 
         if instrument is not None:
-            where.append('c.instrume = %(i)s')
+            where.append('instrume = %(i)s')
             args['i'] = instrument
 
+        # Restrict the latest ompobslog entry search using the same
+        # COMMON conditions as the main query.
+        query_from = "jcmt.COMMON AS c " + self._latest_obslog_join(
+            'p', active_only=True, restrict=self._common_restrict(where))
+
+        where = ['c.' + x for x in where]
+
         # If wanting to exclude NULL values, change query.
         if ompstatus and ompstatus != 0:
             query_from = query_from.replace('LEFT OUTER JOIN', 'INNER JOIN')
@@ -1161,19 +1818,20 @@ class OMPDB:
 
         with self.db.transaction(read_write=False) as c:
             c.execute(query, args)
+
+            if as_arrays:
+                return fetch_arrays(c, fetch_batch_size)
+
             values = c.fetchall()
             cols = c.description
 
         if not values:
             return None
 
-        if self.FullObservationInfo is None:
-            self.FullObservationInfo = namedtuple(
-                'FullObservationInfo',
-                ['{0}_'.format(x[0]) if iskeyword(x[0]) else x[0]
-                 for x in cols])
+        FullObservationInfo = _row_type_from_description(
+            'FullObservationInfo', cols)
 
-        return [self.FullObservationInfo(*i) for i in values]
+        return [FullObservationInfo(*i) for i in values]
 
     def get_remaining_msb_info(self, projectcode):
         """Return msb information for project.
@@ -1184,22 +1842,26 @@ class OMPDB:
         for the results.
 
         """
+
+        return self._run_plan(self._plan_remaining_msb_info(projectcode))
+
+    def _plan_remaining_msb_info(self, projectcode):
+        """Prepare the query plan for get_remaining_msb_info."""
+
         query = ("SELECT pol, instrument, title, wavelength, target, coordstype, ra2000, dec2000, remaining, "
                  " a.timeest,  taumin, taumax, priority "
                  " FROM omp.ompobs AS a JOIN omp.ompmsb  as m ON a.msbid=m.msbid "
                  " WHERE m.projectid=%(p)s AND m.remaining > 0 ")
         args = {'p': projectcode}
-        with self.db.transaction(read_write=False) as c:
-            c.execute(query, args)
-            results = c.fetchall()
-            cols = c.description
 
-        MsbInfo= namedtuple(
-                'MsbInfo',
-                ['{0}_'.format(x[0]) if iskeyword(x[0]) else x[0]
-                 for x in cols])
-        return [MsbInfo(*i) for i in results]
+        def process(results):
+            (rows, cols) = results[0]
+            MsbInfo = _row_type_from_description('MsbInfo', cols)
+            return [MsbInfo(*i) for i in rows]
+
+        return QueryPlan([(query, args)], process)
 
+    @cached_method(project_arg='projectcode')
     def get_project_info(self, projectcode):
         """
         Return project title, semester, hours_assigned, hours_used, taumin, tamx,
@@ -1208,8 +1870,14 @@ class OMPDB:
         PI
 
         """
-        projinfo = namedtuple('projinfo', 'id title semester country allocated_hours remaining_hours opacityrange state pi fops cois')
-        userinfo = namedtuple('userinfo', 'userid uname email cadcuser contactable')
+
+        return self._run_plan(self._plan_project_info(projectcode))
+
+    def _plan_project_info(self, projectcode):
+        """Prepare the query plan for get_project_info."""
+
+        projinfo = _row_type('projinfo', 'id title semester country allocated_hours remaining_hours opacityrange state pi fops cois')
+        userinfo = _row_type('userinfo', 'userid uname email cadcuser contactable')
 
         query_users = ("SELECT u.userid, uname, email, cadcuser, contactable, capacity "
                        "FROM omp.ompprojuser AS pu  JOIN omp.ompuser AS u ON pu.userid=u.userid "
@@ -1221,9 +1889,8 @@ class OMPDB:
 
         args = {'p': projectcode}
 
-        with self.db.transaction(read_write=False) as c:
-            c.execute(query_users, args)
-            uservalues = c.fetchall()
+        def process(results):
+            uservalues = results[0].rows
             fops = []
             pi = []
             cois = []
@@ -1236,24 +1903,75 @@ class OMPDB:
                     fops.append(userinfo(*i[0:-1]))
                 else:
                     logger.warning('User {} in project {} has an unknown capacity {}'.format(i[0], projectcode, i[4]))
-            c.execute(query_proj, args)
-            projvalues = c.fetchall()
-        if len(projvalues) > 1:
-            logger.warning('Project %s found multiple times (nomrally in several semesters). Only first returned', projectcode)
+            projvalues = results[1].rows
+            if len(projvalues) > 1:
+                logger.warning('Project %s found multiple times (nomrally in several semesters). Only first returned', projectcode)
+
+            if len(projvalues) == 0:
+                raise OMPDBError('No project found for {}'.format(projectcode))
+            projvalues = list(projvalues[0])
+            projvalues = projvalues[0:6] + [(projvalues[6], projvalues[7])] + projvalues[8:] + [pi] + [fops] + [cois]
+            return projinfo(*projvalues)
+
+        return QueryPlan([(query_users, args), (query_proj, args)], process)
+
+    def get_project_bundle(self, projectcode, parts=None):
+        """Get the information needed for a project dashboard.
+
+        This runs the queries of several of the project methods
+        in one transaction, using a single connection.  The parts
+        to include can be given as a list of names (see
+        project_bundle_parts) otherwise all parts are fetched.
+
+        Returns a ProjectBundle tuple in which each part's value is as
+        would be returned by the corresponding method, or None if the
+        part was not requested.  Its "timing" entry is an OrderedDict
+        of PartTiming tuples by part, giving the time spent (seconds)
+        running the queries and processing the results.
+        """
+
+        if parts is None:
+            parts = list(project_bundle_parts.keys())
+
+        plans = []
+        for part in parts:
+            plan_method = project_bundle_parts.get(part)
+            if plan_method is None:
+                raise OMPDBError('Unknown project bundle part {}'.format(part))
+
+            plans.append((part, getattr(self, plan_method)(projectcode)))
+
+        fetched = []
+
+        with self.db.transaction(read_write=False) as c:
+            for (part, plan) in plans:
+                start = time()
+                results = _fetch_plan(c, plan)
+                fetched.append((part, plan, results, time() - start))
+
+        values = dict.fromkeys(project_bundle_parts.keys())
+        timing = OrderedDict()
+
+        for (part, plan, results, query_time) in fetched:
+            start = time()
+            values[part] = plan.process(results)
+            timing[part] = PartTiming(query_time, time() - start)
+
+        return ProjectBundle(projectcode=projectcode, timing=timing, **values)
 
-        if len(projvalues) == 0:
-            raise OMPDBError('No project found for {}'.format(projectcode))
-        projvalues = list(projvalues[0])
-        projvalues = projvalues[0:6] + [(projvalues[6], projvalues[7])] + projvalues[8:] + [pi] + [fops] + [cois]
-        project_info = projinfo(*projvalues)
-        return project_info
 
 
 
 
 
+    def get_cso_tau(self, utdatestart, utdateend, hourstart=7, hourend=16,
+                    as_arrays=False):
+        """Get CSO tau values between the given dates.
+
+        Returns a list of csoinfo tuples, or if as_arrays is specified,
+        a dictionary of arrays with the same names.
+        """
 
-    def get_cso_tau(self, utdatestart, utdateend, hourstart=7, hourend=16):
         query = ("SELECT cso_ut, tau FROM jcmt_tms.CSOTAU WHERE cso_ut >= %(utdatestart)s AND cso_ut <= %(utdateend)s")
 
         args = {'utdatestart': utdatestart,
@@ -1261,9 +1979,14 @@ class OMPDB:
                 'hourstart': hourstart,
                 'hourend': hourend,
             }
-        csoinfo = namedtuple('csoinfo', 'date  tau')
+        csoinfo = _row_type('csoinfo', 'date  tau')
         with self.db.transaction(read_write=False) as c:
             c.execute(query, args)
+
+            if as_arrays:
+                return fetch_arrays(
+                    c, fetch_batch_size, names=csoinfo._fields)
+
             rows = c.fetchall()
             results = [csoinfo(*i) for i in rows]
         return results
@@ -1271,15 +1994,15 @@ class OMPDB:
 
 
     def get_questionable_observations_byfop(self, utdatestart, telescope):
-        query = ("SELECT u.userid as `fop`, ou.meail, ou.uname, c.instrume, c.utdate, c.obsnum, o.commentauthor, c.project, c.obsid, o.commenttext "
-                 " FROM omp.ompobslog AS o JOIN jcmt.COMMON AS c ON o.obsid=c.obsid "
+        query = ("SELECT u.userid as `fop`, ou.email, ou.uname, c.instrume, c.utdate, c.obsnum, o.commentauthor, c.project, c.obsid, o.commenttext "
+                 " FROM jcmt.COMMON AS c "
+                 + self._latest_obslog_join('o', join='JOIN') +
                  " JOIN omp.ompprojuser AS u ON c.project=u.projectid "
-                 " JOIN omp.ompuser AS out ON u.userid=ou.userid "
+                 " JOIN omp.ompuser AS ou ON u.userid=ou.userid "
                  " WHERE o.commentstatus=1 AND u.capacity='SUPPORT' "
-                 " AND o.obslogid IN (SELECT MAX(obslogid) FROM ompobslog GROUP BY obsid) "
                  " AND c.utdate >= %(utdatestart)s "
-                 " AND telescope=%(telescope)s "
-                 " AND c.project not like '%CAL%' "
+                 " AND o.telescope=%(telescope)s "
+                 " AND c.project not like '%%CAL%%' "
                  " GROUP BY c.obsid "
                  " ORDER BY fop, c.utdate, c.obsnum");
         args = {'utdatestart': utdatestart,
@@ -0,0 +1,308 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, division
+
+import atexit
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict
+import json
+import logging
+import sys
+from threading import Lock
+from time import time
+
+logger = logging.getLogger(__name__)
+
+QueryRecord = namedtuple('QueryRecord', (
+    'timestamp', 'method', 'query',
+    'wall', 'lock_wait', 'ping', 'execute', 'fetch', 'rows',
+    'error', 'slow', 'caller'))
+
+# Modules whose functions are not considered to be the "calling method"
+# of a query.
+_internal_modules = (
+    'omp.db.backend.', 'omp.db.cache', 'omp.db.instrument', 'contextlib')
+
+# Generic query methods, which are skipped in favour of their caller.
+_generic_methods = frozenset(('read', 'transaction'))
+
+
+def _calling_method(frame):
+    """Determine the database method responsible for a query.
+
+    Searches outward from the given stack frame for the first public
+    method of an object from the omp.db package (other than the backend)
+    and returns its name, prefixed by the class name.  Returns None
+    if no such method is found.
+    """
+
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        name = frame.f_code.co_name
+
+        if (module.startswith('omp.db.')
+                and not module.startswith(_internal_modules)
+                and not name.startswith('_')
+                and name not in _generic_methods):
+            self = frame.f_locals.get('self')
+            if self is not None:
+                return '{}.{}'.format(type(self).__name__, name)
+
+            return name
+
+        frame = frame.f_back
+
+    return None
+
+
+class QueryInstrument(object):
+    """Query timing instrumentation.
+
+    An instance of this class can be given to OMPMySQLLock or
+    OMPMySQLPool (or to OMPDB, which passes it on) as the "instrument"
+    argument.  A QueryRecord is then passed to each of the sinks for
+    every query executed.
+
+    Each record gives the wall time from the start of execution until the
+    end of the last fetch, the time spent executing and fetching results,
+    and the number of rows fetched.  The remaining time until the
+    next query (or the end of the transaction), spent by the caller,
+    is recorded separately.  The time spent waiting for the lock (or for
+    a pooled connection) and pinging the server is included in the record
+    for the first query of each transaction.
+
+    Queries whose execute and fetch times total more than the
+    slow_threshold (seconds) are marked as slow.
+    """
+
+    def __init__(self, sinks=None, slow_threshold=1.0):
+        self.sinks = [] if sinks is None else list(sinks)
+        self.slow_threshold = slow_threshold
+
+    def start_transaction(self, lock_wait=0.0):
+        """Prepare to time the queries of a new transaction."""
+
+        return TransactionTimer(
+            self, _calling_method(sys._getframe(1)), lock_wait)
+
+    def emit(self, record):
+        """Pass a record to each of the sinks."""
+
+        for sink in self.sinks:
+            try:
+                sink.record(record)
+            except Exception:
+                logger.exception('query instrumentation sink failed')
+
+    def report(self):
+        """Get a summary report from those sinks which provide one."""
+
+        return '\n'.join(
+            sink.report() for sink in self.sinks if hasattr(sink, 'report'))
+
+    def register_report(self, stream=None):
+        """Arrange for the summary report to be written at exit.
+
+        The report is written to the given stream, or standard error
+        by default.
+        """
+
+        def write_report():
+            report = self.report()
+            if report:
+                (sys.stderr if stream is None else stream).write(
+                    report + '\n')
+
+        atexit.register(write_report)
+
+
+class TransactionTimer(object):
+    """Accumulates the timing of the queries of one transaction."""
+
+    def __init__(self, instrument, method, lock_wait):
+        self.instrument = instrument
+        self.method = method
+        self.lock_wait = lock_wait
+        self.ping = 0.0
+        self._query = None
+
+    def add_ping(self, duration):
+        self.ping += duration
+
+    def start_query(self, query):
+        """Note the start of a query, emitting the previous record."""
+
+        self._emit()
+
+        self._query = query
+        self._start = self._end = time()
+        self._execute = 0.0
+        self._fetch = 0.0
+        self._rows = 0
+        self._error = False
+
+    def add_execute(self, duration, error=False):
+        self._end = time()
+        self._execute += duration
+        self._error = self._error or error
+
+    def add_fetch(self, duration, rows):
+        self._end = time()
+        self._fetch += duration
+        self._rows += rows
+
+    def finish(self):
+        """Note the end of the transaction, emitting the last record."""
+
+        self._emit()
+
+    def _emit(self):
+        if self._query is None:
+            return
+
+        threshold = self.instrument.slow_threshold
+
+        self.instrument.emit(QueryRecord(
+            timestamp=self._start,
+            method=self.method,
+            query=self._query,
+            wall=self._end - self._start,
+            lock_wait=self.lock_wait,
+            ping=self.ping,
+            execute=self._execute,
+            fetch=self._fetch,
+            rows=self._rows,
+            error=self._error,
+            slow=(threshold is not None
+                  and self._execute + self._fetch > threshold),
+            caller=time() - self._end))
+
+        # Attribute the transaction overheads only to the first query.
+        self.lock_wait = 0.0
+        self.ping = 0.0
+        self._query = None
+
+
+class LoggingSink(object):
+    """Sink writing query records to a logger.
+
+    Slow queries are logged at a separate (higher) level.
+    """
+
+    def __init__(self, logger=logger, level=logging.DEBUG,
+                 slow_level=logging.WARNING):
+        self.logger = logger
+        self.level = level
+        self.slow_level = slow_level
+
+    def record(self, record):
+        self.logger.log(
+            self.slow_level if record.slow else self.level,
+            '%s query (%s): %.3fs (lock %.3fs, ping %.3fs, '
+            'execute %.3fs, fetch %.3fs, caller %.3fs) %i rows%s',
+            'Slow' if record.slow else 'Database',
+            record.method, record.wall, record.lock_wait, record.ping,
+            record.execute, record.fetch, record.caller, record.rows,
+            ('' if not record.slow else ': ' + record.query))
+
+
+class HistogramSink(object):
+    """Sink accumulating statistics in memory by calling method.
+
+    A histogram of query wall times is kept, using the given upper
+    bin edges (seconds).
+    """
+
+    def __init__(self, bins=(0.01, 0.1, 1.0, 10.0)):
+        self.bins = tuple(bins)
+        self._stats = OrderedDict()
+        self._lock = Lock()
+
+    def record(self, record):
+        with self._lock:
+            stats = self._stats.get(record.method)
+
+            if stats is None:
+                stats = self._stats[record.method] = {
+                    'count': 0,
+                    'slow': 0,
+                    'error': 0,
+                    'rows': 0,
+                    'wall': 0.0,
+                    'wall_max': 0.0,
+                    'lock_wait': 0.0,
+                    'ping': 0.0,
+                    'fetch': 0.0,
+                    'histogram': [0] * (len(self.bins) + 1),
+                }
+
+            stats['count'] += 1
+            stats['slow'] += int(record.slow)
+            stats['error'] += int(record.error)
+            stats['rows'] += record.rows
+            stats['wall'] += record.wall
+            stats['wall_max'] = max(stats['wall_max'], record.wall)
+            stats['lock_wait'] += record.lock_wait
+            stats['ping'] += record.ping
+            stats['fetch'] += record.fetch
+            stats['histogram'][bisect_left(self.bins, record.wall)] += 1
+
+    def get_stats(self):
+        """Get a dictionary of statistics dictionaries by method."""
+
+        with self._lock:
+            return OrderedDict(
+                (method, dict(stats, histogram=list(stats['histogram'])))
+                for (method, stats) in self._stats.items())
+
+    def report(self):
+        """Get a text summary, with the slowest methods first."""
+
+        stats = self.get_stats()
+
+        lines = [
+            '{:<40} {:>7} {:>5} {:>10} {:>9} {:>9} {:>9}  {}'.format(
+                'Method', 'Queries', 'Slow', 'Rows', 'Total (s)',
+                'Mean (s)', 'Max (s)',
+                'Histogram (<={})'.format(
+                    ', '.join(str(x) for x in self.bins)))]
+
+        for (method, entry) in sorted(
+                stats.items(), key=lambda x: -x[1]['wall']):
+            lines.append(
+                '{:<40} {:>7} {:>5} {:>10} {:>9.3f} {:>9.3f} {:>9.3f}  {}'
+                .format(
+                    str(method), entry['count'], entry['slow'],
+                    entry['rows'], entry['wall'],
+                    entry['wall'] / entry['count'], entry['wall_max'],
+                    ' '.join(str(x) for x in entry['histogram'])))
+
+        return '\n'.join(lines)
+
+
+class JSONLinesSink(object):
+    """Sink appending query records to a file as lines of JSON."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = Lock()
+
+    def record(self, record):
+        line = json.dumps(record._asdict())
+
+        with self._lock:
+            with open(self.filename, 'a') as f:
+                f.write(line + '\n')
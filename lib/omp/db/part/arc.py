@@ -4,21 +4,62 @@
 
 __author__ = "Russell O. Redman"
 
+from collections import namedtuple, OrderedDict
 from datetime import datetime, timedelta
 import logging
-
-from omp.db.db import OMPDB
+import sys
+from threading import Event, Thread
+from time import sleep
+
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
+from omp.db.arrays import fetch_arrays
+from omp.db.cache import cached_method
+from omp.db.db import OMPDB, fetch_batch_size, query_chunk_size, \
+    _chunked, _in_params
+from omp.error import OMPDBTransientError
 from omp.siteconfig import get_omp_siteconfig
 
 logger = logging.getLogger(__name__)
 
+# Number of times ArcDB.read retries a query after a transient error,
+# and the initial delay (seconds) before retrying, which is doubled
+# for each subsequent attempt.
+read_retries = 3
+read_retry_delay = 1.0
+
+# Backends for which observations are described by the ACSIS table
+# rather than the SCUBA2 table.
+heterodyne_backends = ('ACSIS', 'DAS', 'AOS-C')
+
+ObservationContext = namedtuple('ObservationContext', (
+    'obsid', 'common', 'instrument', 'files', 'product_info',
+    'project_pi', 'project_title'))
+
 
 class ArcDB(OMPDB):
-    def __init__(self, dev=False):
+    header_cache = None
+
+    def __init__(self, dev=False, header_cache=None, **kwargs):
         """
         Create a new connection to the MySQL server
+
+        An ArcHeaderCache can be given as header_cache, in which case
+        header queries covering only the dates (or observations) which it
+        holds are answered from the cache rather than the server.
+        This is not permitted with the dev option since the cache
+        is a copy of the jcmt database.
+
+        Additional keyword arguments, such as pool_size, are passed
+        to the OMPDB constructor.
         """
 
+        if dev and header_cache is not None:
+            raise Exception('Header cache can not be used with dev database')
+
         config = get_omp_siteconfig(dev=dev)
 
         if config.get('hdr_database', 'driver') != 'mysql':
@@ -30,25 +71,38 @@ class ArcDB(OMPDB):
             server=config.get('hdr_database', 'server'),
             user=config.get('hdr_database', 'user'),
             password=config.get('hdr_database', 'password'),
-            read_only=True)
+            read_only=True,
+            **kwargs)
+
+        self.header_cache = header_cache
 
-    def read(self, query, params={}):
+    def read(self, query, params={}, iterate=False,
+             batch_size=fetch_batch_size, retries=read_retries,
+             retry_delay=read_retry_delay):
         """
-        Run an sql query, multiple times if necessary, using read_connection.
-        Only one read can be active at a time, protected by the read_mutex,
-        but it can run in parallel with a write transaction.
+        Run an sql query, multiple times if necessary.
+
+        If the query fails with a transient error (e.g. loss of the
+        connection to the server) it is retried up to the given number of
+        times, waiting retry_delay seconds before the first retry and
+        doubling the delay each time.
 
         Arguments:
         query: a properly formated SQL select query
         params: dictionary of parameters to pass to execute
+        iterate: if true, return a generator which streams the rows from
+            the database in batches of batch_size rather than a list
+            of all of the rows.  In this case the query can only be
+            retried if it fails before any rows have been returned.
         """
 
-        returnList = []
-        logger.info(query)
-        retry = True
-        number = 0
+        logger.debug(query)
 
-        try:
+        if iterate:
+            return self._read_iterate(
+                query, params, batch_size, retries, retry_delay)
+
+        def read_all():
             with self.db.transaction() as cursor:
                 logger.debug('cursor obtained, exceuting query...')
                 cursor.execute(query, params)
@@ -56,12 +110,122 @@ class ArcDB(OMPDB):
                 returnList = cursor.fetchall()
                 logger.debug('results fetched')
 
-        except Exception as e:
-            logger.exception('database read failed')
-            raise
+            return returnList
+
+        return self._read_retry(read_all, retries, retry_delay)
+
+    def _read_many(self, queries, retries=None, retry_delay=None):
+        """
+        Run a list of (query, params) select queries in one transaction,
+        retrying as for the read method.
+
+        Returns a list of the rows resulting from each query.
+        """
+
+        def read_all():
+            results = []
+
+            with self.db.transaction() as cursor:
+                for (query, params) in queries:
+                    cursor.execute(query, params)
+                    results.append(cursor.fetchall())
+
+            return results
+
+        return self._read_retry(read_all, retries, retry_delay)
+
+    def _read_retry(self, function, retries=None, retry_delay=None):
+        """
+        Call a function which reads from the database, retrying it
+        after transient errors and logging failures.
+
+        The retries and retry_delay default to the module's read_retries
+        and read_retry_delay values.
+        """
+
+        if retries is None:
+            retries = read_retries
+        if retry_delay is None:
+            retry_delay = read_retry_delay
+
+        attempt = 0
+
+        while True:
+            try:
+                return function()
+
+            except OMPDBTransientError:
+                if attempt >= retries:
+                    logger.exception('database read failed')
+                    raise
+
+                self._read_retry_wait(attempt, retry_delay)
+                attempt += 1
+
+            except Exception:
+                logger.exception('database read failed')
+                raise
+
+    def _read_iterate(self, query, params, batch_size, retries, retry_delay):
+        """
+        Generator implementing the iterate mode of the read method.
+        """
 
-        return returnList
+        attempt = 0
 
+        while True:
+            n_rows = 0
+
+            try:
+                with self.db.transaction() as cursor:
+                    cursor.execute(query, params)
+
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            return
+
+                        for row in rows:
+                            n_rows += 1
+                            yield row
+
+            except OMPDBTransientError:
+                if n_rows or attempt >= retries:
+                    logger.exception('database read failed')
+                    raise
+
+                self._read_retry_wait(attempt, retry_delay)
+                attempt += 1
+
+    def _read_retry_wait(self, attempt, retry_delay):
+        """
+        Log a read failure and wait before retrying.
+        """
+
+        delay = retry_delay * (2 ** attempt)
+        logger.warning(
+            'database read failed (attempt %i), retrying in %.1f s',
+            attempt + 1, delay)
+        sleep(delay)
+
+    def _read_header_query(self, query, args, date_start=None, date_end=None,
+                           iterate=False, batch_size=fetch_batch_size):
+        """
+        Run a header query, using the header cache if it covers
+        the given UT date range.
+        """
+
+        cache = self.header_cache
+
+        if cache is not None and cache.covers(date_start, date_end):
+            logger.debug('reading from header cache')
+            return cache.read(
+                query, args, iterate=iterate, batch_size=batch_size)
+
+        return OMPDB._read_header_query(
+            self, query, args, iterate=iterate, batch_size=batch_size)
+
+    @cached_method(project_arg='project_id')
     def get_project_pi_title(self, project_id):
         """
         Retrieve the PI name and project title for the given project.
@@ -174,25 +338,58 @@ class ArcDB(OMPDB):
         If a value is null, a default value will be returned in its place
         that depends upon the data_type.
         """
+
+        return self.query_table_many(table, [obsid])[obsid]
+
+    def query_table_many(self, table, obsids, chunk_size=query_chunk_size):
+        """
+        Query a specified table for a set of columns, for multiple
+        observations.
+
+        The obsids are queried in chunks of at most the given size,
+        all within one transaction (retried as for the read method
+        after transient errors).  If there is a header cache,
+        observations which it holds are read from the cache instead.
+
+        Returns:
+        An OrderedDict, by obsid, of lists of dictionaries as would
+        be returned by query_table.  Each obsid is included, with
+        an empty list if there are no matching rows.
+        """
+
         columns = self.query_table_columns[table]
-        selection = ',\n'.join(['    ' + key
-                                for key in columns])
-        sqlcmd = '\n'.join(['SELECT',
-                            '%s' % (selection,),
-                            'FROM ' + self.jcmt_db + table,
-                            'WHERE obsid = "%s"' % (obsid,)])
-
-        answer = self.read(sqlcmd)
+        result = OrderedDict((obsid, []) for obsid in obsids)
+        remaining = list(result.keys())
+
+        cache = self.header_cache
+        if cache is not None:
+            cached = cache.find_obsids(remaining)
+
+            if cached:
+                remaining = [x for x in remaining if x not in cached]
+
+                for row in cache.read_obsids(table, columns, cached):
+                    result[row[0]].append(dict(zip(columns, row[1:])))
+
+        if not remaining:
+            return result
+
+        queries = []
+        for chunk in _chunked(remaining, chunk_size):
+            args = {}
+            queries.append((
+                'SELECT obsid, ' + ', '.join(columns) +
+                ' FROM ' + self.jcmt_db + table +
+                ' WHERE obsid IN (' + _in_params('o', chunk, args) + ')',
+                args))
+
+        for rows in self._read_many(queries):
+            for row in rows:
+                result[row[0]].append(dict(zip(columns, row[1:])))
+
         logger.debug('query complete')
-        rowlist = []
-        for row in answer:
-            rowdict = {}
-            for key, value in zip(columns, row):
-                rowdict[key] = value
-            rowlist.append(rowdict)
-        logger.info(repr(rowlist))
 
-        return rowlist
+        return result
 
     def get_files(self, obsid, with_info=False):
         """
@@ -203,35 +400,58 @@ class ArcDB(OMPDB):
         obsid: the observation identifier for the observation
         with_info: return (name, size, md5sum) dictionaries instead
         """
-        sqlcmd = '\n'.join([
-            'SELECT ',
-            '    obsid_subsysnr, file_id, filesize, md5sum',
-            'FROM ' + self.jcmt_db + 'FILES',
-            'WHERE obsid="%s"' % (obsid,),
-            'ORDER BY obsid_subsysnr, file_id'])
-        answer = self.read(sqlcmd)
-        logger.debug('query complete')
 
-        if not answer:
-            return None
+        return self.get_files_many([obsid], with_info=with_info)[obsid]
 
-        results = {}
+    def get_files_many(self, obsids, with_info=False,
+                       chunk_size=query_chunk_size):
+        """
+        Get the lists of files for multiple observations.
 
-        for row in answer:
-            (obsid_subsysnr, filename, filesize, md5sum) = row
-            if obsid_subsysnr not in results:
-                results[obsid_subsysnr] = []
+        The obsids are queried in chunks of at most the given size,
+        all within one transaction (retried as for the read method
+        after transient errors).
 
-            if with_info:
-                results[obsid_subsysnr].append({
-                    'name': filename,
-                    'size': filesize,
-                    'md5sum': md5sum,
-                })
-            else:
-                results[obsid_subsysnr].append(filename)
+        Returns an OrderedDict, by obsid, of the results which would
+        be returned by get_files, i.e. None for observations without
+        any files.
+        """
 
-        return results
+        result = OrderedDict((obsid, None) for obsid in obsids)
+
+        queries = []
+        for chunk in _chunked(result.keys(), chunk_size):
+            args = {}
+            queries.append((
+                'SELECT obsid, obsid_subsysnr, file_id, filesize, md5sum'
+                ' FROM ' + self.jcmt_db + 'FILES'
+                ' WHERE obsid IN (' + _in_params('o', chunk, args) + ')'
+                ' ORDER BY obsid, obsid_subsysnr, file_id',
+                args))
+
+        for rows in self._read_many(queries):
+            for row in rows:
+                (obsid, obsid_subsysnr, filename, filesize, md5sum) = row
+
+                files = result[obsid]
+                if files is None:
+                    files = result[obsid] = {}
+
+                if obsid_subsysnr not in files:
+                    files[obsid_subsysnr] = []
+
+                if with_info:
+                    files[obsid_subsysnr].append({
+                        'name': filename,
+                        'size': filesize,
+                        'md5sum': md5sum,
+                    })
+                else:
+                    files[obsid_subsysnr].append(filename)
+
+        logger.debug('query complete')
+
+        return result
 
     def get_heterodyne_product_info(self, backend, obsid):
         """
@@ -245,40 +465,234 @@ class ArcDB(OMPDB):
         observation might be a hybrid if hybrid > 1.
         """
 
+        return self.get_heterodyne_product_info_many(
+            backend, obsids=[obsid]).get(obsid, [])
+
+    def get_heterodyne_product_info_many(
+            self, backend, obsids=None, utdate_start=None, utdate_end=None,
+            page_days=7, chunk_size=query_chunk_size):
+        """
+        Retrieve heterodyne product ID information for multiple
+        observations.
+
+        Either a list of obsids, which are queried in chunks of at most
+        the given size, or a range of UT dates (YYYYMMDD integers,
+        inclusive) must be given.  In the latter case all observations
+        with the given backend are included, and the range is queried in
+        pages of the given number of days to keep each query small.
+        All queries are performed within one transaction, which is
+        retried as for the read method after transient errors.
+
+        Returns a dictionary, by obsid, of lists of results as would be
+        returned by get_heterodyne_product_info.  Obsids without ACSIS
+        entries are omitted.
+        """
+
         if backend == 'ACSIS':
-            sqlcmd = '\n'.join([
-                     'SELECT a.subsysnr,',
-                     '       min(a.restfreq),',
-                     '       min(a.bwmode),',
-                     '       min(aa.subsysnr),',
-                     '       count(aa.subsysnr),',
-                     '       min(a.ifchansp) ',
-                     'FROM ' + self.jcmt_db + 'ACSIS a',
-                     '    INNER JOIN ' + self.jcmt_db + 'ACSIS aa',
-                     '        ON a.obsid=aa.obsid',
-                     '        AND a.restfreq=aa.restfreq',
-                     '        AND a.iffreq=aa.iffreq',
-                     '        AND a.ifchansp=aa.ifchansp',
-                     'WHERE a.obsid = "%s"' % (obsid,),
-                     'GROUP BY a.subsysnr'])
+            select = [
+                'SELECT a.obsid,',
+                '       a.subsysnr,',
+                '       min(a.restfreq),',
+                '       min(a.bwmode),',
+                '       min(aa.subsysnr),',
+                '       count(aa.subsysnr),',
+                '       min(a.ifchansp) ',
+                'FROM ' + self.jcmt_db + 'ACSIS a',
+                '    INNER JOIN ' + self.jcmt_db + 'ACSIS aa',
+                '        ON a.obsid=aa.obsid',
+                '        AND a.restfreq=aa.restfreq',
+                '        AND a.iffreq=aa.iffreq',
+                '        AND a.ifchansp=aa.ifchansp',
+            ]
+            group = 'GROUP BY a.obsid, a.subsysnr'
 
         elif backend in ['DAS', 'AOS-C']:
-            sqlcmd = '\n'.join([
-                     'SELECT a.subsysnr,',
-                     '       a.restfreq,',
-                     '       a.bwmode,',
-                     '       a.specid,',
-                     '       count(aa.subsysnr)',
-                     'FROM ' + self.jcmt_db + 'ACSIS a',
-                     '    INNER JOIN ' + self.jcmt_db + 'ACSIS aa',
-                     '        ON a.obsid=aa.obsid',
-                     '        AND a.specid=aa.specid',
-                     'WHERE a.obsid = "%s"' % (obsid,),
-                     'GROUP BY a.subsysnr, a.restfreq, a.bwmode, a.specid'])
+            select = [
+                'SELECT a.obsid,',
+                '       a.subsysnr,',
+                '       a.restfreq,',
+                '       a.bwmode,',
+                '       a.specid,',
+                '       count(aa.subsysnr)',
+                'FROM ' + self.jcmt_db + 'ACSIS a',
+                '    INNER JOIN ' + self.jcmt_db + 'ACSIS aa',
+                '        ON a.obsid=aa.obsid',
+                '        AND a.specid=aa.specid',
+            ]
+            group = ('GROUP BY a.obsid, a.subsysnr, a.restfreq, '
+                     'a.bwmode, a.specid')
         else:
             raise Exception('backend = ' + backend + ' is not supported')
 
-        return self.read(sqlcmd)
+        queries = []
+
+        if obsids is not None:
+            for chunk in _chunked(obsids, chunk_size):
+                args = {}
+                queries.append(('\n'.join(select + [
+                    'WHERE a.obsid IN (' + _in_params('o', chunk, args) + ')',
+                    group]), args))
+
+        elif utdate_start is not None and utdate_end is not None:
+            date = datetime.strptime(str(utdate_start), '%Y%m%d')
+            date_end = datetime.strptime(str(utdate_end), '%Y%m%d')
+            page = timedelta(days=page_days)
+
+            while date <= date_end:
+                page_end = min(date + page - timedelta(days=1), date_end)
+
+                queries.append(('\n'.join(select + [
+                    '    INNER JOIN ' + self.jcmt_db + 'COMMON c',
+                    '        ON a.obsid=c.obsid',
+                    'WHERE c.utdate BETWEEN %(ds)s AND %(de)s',
+                    '    AND c.backend=%(be)s',
+                    group]), {
+                        'ds': int(date.strftime('%Y%m%d')),
+                        'de': int(page_end.strftime('%Y%m%d')),
+                        'be': backend,
+                    }))
+
+                date = page_end + timedelta(days=1)
+
+        else:
+            raise Exception('either obsids or a date range must be given')
+
+        result = {}
+
+        for rows in self._read_many(queries):
+            for row in rows:
+                obsid = row[0]
+                if obsid not in result:
+                    result[obsid] = []
+                result[obsid].append(row[1:])
+
+        return result
+
+    def iter_observation_contexts(self, obsids, batch_size=100, prefetch=2):
+        """
+        Generate the database information needed to ingest each
+        of the given observations.
+
+        The information is loaded in batches of the given number of
+        observations by a background thread, which keeps up to "prefetch"
+        batches ready so that the caller need not wait for the database
+        between observations.  Each batch is loaded with one query
+        per table (see query_table_many and get_files_many).
+
+        Yields an ObservationContext tuple for each (distinct) obsid, in
+        the order given, containing:
+
+        obsid: the observation identifier
+        common: the query_table dictionary for COMMON, or None if the
+            observation was not found
+        instrument: the query_table list for ACSIS or SCUBA2
+        files: the get_files result
+        product_info: the get_heterodyne_product_info result, or None
+            for SCUBA-2 observations
+        project_pi, project_title: as returned by get_project_pi_title
+        """
+
+        batches = Queue(maxsize=prefetch)
+        stop = Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=1)
+                    return True
+                except Full:
+                    pass
+
+            return False
+
+        def load():
+            try:
+                for batch in _chunked(obsids, batch_size):
+                    if not put((self._load_observation_contexts(batch),
+                                None)):
+                        return
+
+                put((None, None))
+
+            except Exception:
+                put((None, sys.exc_info()[1]))
+
+        thread = Thread(target=load)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            while True:
+                (contexts, error) = batches.get()
+
+                if error is not None:
+                    raise error
+
+                if contexts is None:
+                    break
+
+                for context in contexts:
+                    yield context
+
+        finally:
+            stop.set()
+
+    def _load_observation_contexts(self, obsids):
+        """
+        Load a list of ObservationContext tuples for the given obsids.
+        """
+
+        common = self.query_table_many('COMMON', obsids)
+
+        table_obsids = {'ACSIS': [], 'SCUBA2': []}
+        for (obsid, rows) in common.items():
+            if rows:
+                table_obsids[
+                    'ACSIS' if rows[0]['backend'] in heterodyne_backends
+                    else 'SCUBA2'].append(obsid)
+
+        instrument = {}
+        for (table, table_obsid) in table_obsids.items():
+            if table_obsid:
+                instrument.update(self.query_table_many(table, table_obsid))
+
+        files = self.get_files_many(obsids)
+
+        heterodyne_obsids = {}
+        for (obsid, rows) in common.items():
+            if rows and rows[0]['backend'] in heterodyne_backends:
+                heterodyne_obsids.setdefault(
+                    rows[0]['backend'], []).append(obsid)
+
+        product_info = {}
+        for (backend, backend_obsids) in heterodyne_obsids.items():
+            product_info.update(self.get_heterodyne_product_info_many(
+                backend, obsids=backend_obsids))
+
+        projects = {}
+        contexts = []
+
+        for (obsid, rows) in common.items():
+            if not rows:
+                contexts.append(ObservationContext(
+                    obsid, None, [], files[obsid], None, None, None))
+                continue
+
+            row = rows[0]
+
+            obs_product_info = None
+            if row['backend'] in heterodyne_backends:
+                obs_product_info = product_info.get(obsid, [])
+
+            project = row['project']
+            if project not in projects:
+                projects[project] = self.get_project_pi_title(project)
+
+            contexts.append(ObservationContext(
+                obsid, row, instrument[obsid], files[obsid], obs_product_info,
+                *projects[project]))
+
+        return contexts
 
     def get_obs_bounds(self,
                        project=None, date_start=None, date_end=None,
@@ -292,12 +706,27 @@ class ArcDB(OMPDB):
                        exclude_known_bad=True, proprietary=None,
                        proprietary_date=None,
                        allow_ec_cal=False, obstype=None,
-                       inbeam_pol=False, inbeam_fts=False, inbeam_null=False):
+                       inbeam_pol=False, inbeam_fts=False, inbeam_null=False,
+                       instrument_info=False,
+                       iterate=False, batch_size=fetch_batch_size,
+                       as_arrays=False):
         """
         Fetch the bounds from the JCMT COMMON table.
+
+        If the iterate option is given, returns a generator which
+        fetches the rows from the database in pages of the given size,
+        each by a separate short query, rather than a list of all
+        of the rows.
+
+        If the as_arrays option is given, returns a dictionary of
+        NumPy masked arrays by column name instead.
         """
 
+        if iterate and as_arrays:
+            raise Exception('iterate and as_arrays are mutually exclusive')
+
         conditions = []
+        acsis_conditions = []
         params = {}
         needs_acsis = False
         fields = ['obsratl', 'obsrabl', 'obsratr', 'obsrabr',
@@ -308,9 +737,9 @@ class ArcDB(OMPDB):
             params['p'] = project
         else:
             if not allow_ec_cal:
-                conditions.append('project NOT LIKE "%%EC%%"')
-                conditions.append('project <> "JCMTCAL"')
-                conditions.append('project <> "CAL"')
+                conditions.append("project NOT LIKE '%%EC%%'")
+                conditions.append("project <> 'JCMTCAL'")
+                conditions.append("project <> 'CAL'")
 
         if date_start is not None:
             conditions.append('utdate>=%(ds)s')
@@ -328,9 +757,9 @@ class ArcDB(OMPDB):
             params['ni'] = not_instrument.upper()
 
         if inbeam_pol:
-            conditions.append('inbeam LIKE "%%pol%%"')
+            conditions.append("inbeam LIKE '%%pol%%'")
         if inbeam_fts:
-            conditions.append('inbeam LIKE "%%fts%%"')
+            conditions.append("inbeam LIKE '%%fts%%'")
         if inbeam_null:
             conditions.append('inbeam IS NULL')
 
@@ -362,17 +791,17 @@ class ArcDB(OMPDB):
 
         if rest_freq is not None:
             needs_acsis = True
-            conditions.append('abs(restfreq - %(rf)s) < 0.0001')
+            acsis_conditions.append('abs(restfreq - %(rf)s) < 0.0001')
             params['rf'] = rest_freq
 
         if if_freq is not None:
             needs_acsis = True
-            conditions.append('abs(iffreq - %(if)s) < 0.0001')
+            acsis_conditions.append('abs(iffreq - %(if)s) < 0.0001')
             params['if'] = if_freq
 
         if bw_mode is not None:
             needs_acsis = True
-            conditions.append('bwmode=%(bwm)s')
+            acsis_conditions.append('bwmode=%(bwm)s')
             params['bwm'] = bw_mode
 
         if project_info or project_map_info:
@@ -387,14 +816,17 @@ class ArcDB(OMPDB):
         if object_info:
             fields.append('object')
 
+        if instrument_info:
+            fields.append('instrume')
+
         if science_only:
-            conditions.append('obs_type="science"')
+            conditions.append("obs_type='science'")
         elif obstype is not None:
             conditions.append('obs_type=%(ot)s')
             params['ot'] = obstype
 
         if no_freq_sw:
-            conditions.append('sw_mode<>"freqsw"')
+            conditions.append("sw_mode<>'freqsw'")
 
         if exclude_known_bad:
             if instrument is None or instrument == 'SCUBA-2':
@@ -432,14 +864,17 @@ class ArcDB(OMPDB):
             if proprietary_date is None:
                 prop_date_str = 'now()'
             else:
-                prop_date_str = '"' + proprietary_date + '"'
+                prop_date_str = '%(pd)s'
+                params['pd'] = proprietary_date
             if proprietary:
                 conditions.append('release_date > ' + prop_date_str)
             else:
                 conditions.append('release_date <= ' + prop_date_str)
 
-        if conditions:
-            condition = ' WHERE ' + ' AND '.join(conditions)
+        all_conditions = conditions + acsis_conditions
+
+        if all_conditions:
+            condition = ' WHERE ' + ' AND '.join(all_conditions)
         else:
             condition = ''
 
@@ -449,12 +884,29 @@ class ArcDB(OMPDB):
         else:
             extra_table = ''
 
-        with self.db.transaction() as c:
-            c.execute('SELECT ' + ', '.join(fields) +
-                      ' FROM jcmt.COMMON' + extra_table + condition,
-                      params)
+        query = ('SELECT ' + ', '.join(fields) +
+                 ' FROM jcmt.COMMON' + extra_table + condition)
 
-            return c.fetchall()
+        if iterate and not (self.header_cache is not None and
+                            self.header_cache.covers(date_start, date_end)):
+            # Page through the results by obsid so that slow processing
+            # of the rows does not hold a result set open on the server.
+            # Each page of obsid values is selected from COMMON alone,
+            # using its index, before the joined rows are fetched.
+            return self._iterate_paged(
+                fields, 'jcmt.COMMON' + extra_table, all_conditions, params,
+                'jcmt.COMMON.obsid', 'jcmt.COMMON', conditions,
+                batch_size=batch_size)
+
+        if as_arrays:
+            with self.db.transaction() as c:
+                c.execute(query, params)
+
+                return fetch_arrays(c, batch_size)
+
+        return self._read_header_query(
+            query, params, date_start=date_start, date_end=date_end,
+            iterate=iterate, batch_size=batch_size)
 
     def get_obsid_and_project(self, utdate, obsnum):
         with self.db.transaction() as c:
@@ -517,8 +969,8 @@ class ArcDB(OMPDB):
             query = query + 'AND obs_type=%(obstype)s '
             args['obstype'] = obstype
 
-        print("Query: " + query)
-        print("Params: " + repr(args))
+        logger.debug('Query: %s', query)
+        logger.debug('Params: %r', args)
 
         result = []
 
@@ -558,13 +1010,16 @@ class ArcDB(OMPDB):
 
         return result
 
-    def read_cso_opacity_data_range(self, utc0, utc1):
+    def read_cso_opacity_data_range(self, utc0, utc1, as_arrays=False):
         with self.db.transaction() as c:
             c.execute(
                 'select cso_ut, tau, tau_rms from jcmt_tms.CSOTAU '
                 'where cso_ut>=%(ds)s and cso_ut<=%(de)s ',
                 {'ds': utc0, 'de': utc1})
 
+            if as_arrays:
+                return fetch_arrays(c, fetch_batch_size)
+
             rows = c.fetchall()
 
         return rows
@@ -0,0 +1,441 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import logging
+from math import sqrt
+import re
+import sqlite3
+from threading import RLock
+
+from mysql.connector import FieldType
+from pytz import UTC
+
+from omp.db.db import fetch_batch_size, _chunked
+from omp.error import OMPDBError
+
+logger = logging.getLogger(__name__)
+
+# Header tables held in the cache.  Rows of the other tables are selected
+# via their observation's COMMON entry.
+cached_tables = ('COMMON', 'ACSIS', 'SCUBA2')
+
+# Default number of days before the present for which observations are
+# not cached, since their headers may still be updated.
+default_recent_days = 30
+
+# Default number of minutes before the most recent "last_modified" value
+# from which to fetch observations again, in case of rows committed late.
+default_modified_margin = 5
+
+# Maximum number of parameters to use in a single SQLite query.
+_sqlite_chunk_size = 500
+
+# SQLite column types by MySQL field type.  The date and time types use
+# names registered as converters below, so that values are returned
+# as datetime objects.  Other field types are stored as text.
+_column_types = {}
+
+for (_field_types, _column_type) in (
+        (('TINY', 'SHORT', 'LONG', 'LONGLONG', 'INT24', 'YEAR'),
+         'INTEGER'),
+        (('FLOAT', 'DOUBLE', 'DECIMAL', 'NEWDECIMAL'),
+         'REAL'),
+        (('DATE', 'NEWDATE'),
+         'OMPDATE'),
+        (('DATETIME', 'TIMESTAMP'),
+         'OMPDATETIME'),
+        ):
+    for _field_type in _field_types:
+        _column_types[getattr(FieldType, _field_type)] = _column_type
+
+
+def _convert_datetime(value):
+    value = value.decode('ascii')
+    return datetime.strptime(
+        value, '%Y-%m-%d %H:%M:%S.%f' if '.' in value
+        else '%Y-%m-%d %H:%M:%S')
+
+
+def _convert_date(value):
+    return datetime.strptime(value.decode('ascii'), '%Y-%m-%d').date()
+
+
+sqlite3.register_converter('OMPDATETIME', _convert_datetime)
+sqlite3.register_converter('OMPDATE', _convert_date)
+
+
+def _adapt_value(value):
+    """Convert a value from MySQL to a type which SQLite can store."""
+
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    elif isinstance(value, date):
+        return value.isoformat()
+    elif isinstance(value, Decimal):
+        return float(value)
+
+    return value
+
+
+def _sqlite_now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _sqlite_sqrt(value):
+    if value is None or value < 0:
+        return None
+
+    return sqrt(value)
+
+
+class ArcHeaderCache(object):
+    """Local cache of JCMT header tables, stored in an SQLite file.
+
+    The cache holds the COMMON, ACSIS and SCUBA2 rows for observations
+    from date_start (or all observations if this is None) until
+    recent_days before the last synchronization.  More recent observations
+    are left to be read from MySQL since their headers are more likely
+    to be updated.
+
+    The sync method must be called to populate the cache and, later,
+    to update it.  It fetches observations which have entered the cached
+    date range since the last synchronization, and any whose COMMON
+    "last_modified" value is not earlier than modified_margin minutes
+    before that of the most recently modified observation already cached.
+    (The margin allows for rows whose transactions were committed after
+    a later-modified row had been read.)  Observations deleted from
+    the database are not removed from the cache.
+
+    An instance of this class can be given to ArcDB as its "header_cache"
+    argument.  Queries covering only cached dates or observations are
+    then answered from this cache.  The queries are written for MySQL
+    but are run unchanged apart from the parameter style.  (NOW() is
+    evaluated in the local time zone and DECIMAL values are
+    stored as floating point numbers.)
+    """
+
+    def __init__(self, filename, date_start=None,
+                 recent_days=default_recent_days,
+                 modified_margin=default_modified_margin):
+        self.filename = filename
+        self.date_start = date_start
+        self.recent_days = recent_days
+        self.modified_margin = modified_margin
+
+        self._lock = RLock()
+
+        self._conn = sqlite3.connect(
+            ':memory:', detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False)
+
+        # Attach the cache file with the schema name "jcmt", so that
+        # table names such as "jcmt.COMMON" can be used unchanged.
+        self._conn.execute('ATTACH DATABASE ? AS jcmt', (filename,))
+        self._conn.create_function('NOW', 0, _sqlite_now)
+        self._conn.create_function('SQRT', 1, _sqlite_sqrt)
+
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jcmt.sync_state '
+            '(name TEXT PRIMARY KEY, value TEXT)')
+        self._conn.commit()
+
+        self._state = dict(self._conn.execute(
+            'SELECT name, value FROM jcmt.sync_state').fetchall())
+
+        if self._state:
+            cached_start = self._get_state_int('date_start')
+            if cached_start != date_start:
+                raise OMPDBError(
+                    'header cache {} has start date {}, not {}'.format(
+                        filename, cached_start, date_start))
+
+    def close(self):
+        """Close the cache file."""
+
+        with self._lock:
+            self._conn.close()
+
+    def _get_state_int(self, name):
+        value = self._state.get(name)
+        return None if value is None else int(value)
+
+    def get_date_end(self):
+        """Get the last UT date (YYYYMMDD integer) held in the cache,
+        or None if it has not been synchronized."""
+
+        return self._get_state_int('date_end')
+
+    def covers(self, date_start, date_end):
+        """Determine whether the cache holds all observations in the
+        given UT date range.
+
+        A date_start of None means the beginning of the archive,
+        and a date_end of None means the present.
+        """
+
+        cached_end = self.get_date_end()
+
+        if cached_end is None or date_end is None:
+            return False
+
+        if int(date_end) > cached_end:
+            return False
+
+        if self.date_start is not None and (
+                date_start is None or int(date_start) < self.date_start):
+            return False
+
+        return True
+
+    def find_obsids(self, obsids):
+        """Determine which of the given obsids are held in the cache.
+
+        Returns a set of obsids.
+        """
+
+        found = set()
+
+        if self.get_date_end() is None:
+            return found
+
+        with self._lock:
+            for chunk in _chunked(obsids, _sqlite_chunk_size):
+                found.update(x[0] for x in self._conn.execute(
+                    'SELECT obsid FROM jcmt.COMMON WHERE obsid IN (' +
+                    ', '.join('?' for x in chunk) + ')', chunk))
+
+        return found
+
+    def read_obsids(self, table, columns, obsids):
+        """Read the given columns of a cached table for the given obsids.
+
+        Returns a list of rows, each beginning with the obsid followed
+        by the requested columns.
+        """
+
+        rows = []
+
+        with self._lock:
+            for chunk in _chunked(obsids, _sqlite_chunk_size):
+                rows.extend(self._conn.execute(
+                    'SELECT obsid, {} FROM jcmt.{} WHERE obsid IN ({})'.format(
+                        ', '.join(columns), table,
+                        ', '.join('?' for x in chunk)),
+                    chunk))
+
+        return rows
+
+    def read(self, query, args, iterate=False, batch_size=fetch_batch_size):
+        """Run a MySQL-style query against the cache.
+
+        Parameters of the form "%(name)s" are converted to the SQLite
+        ":name" style.
+
+        Returns a list of rows, or if iterate is specified, a generator
+        which fetches them in batches of the given size.
+        """
+
+        query = re.sub(r'%\((\w+)\)s', r':\1', query).replace('%%', '%')
+
+        if iterate:
+            return self._iterate(query, args, batch_size)
+
+        with self._lock:
+            return self._conn.execute(query, args).fetchall()
+
+    def _iterate(self, query, args, batch_size):
+        with self._lock:
+            cursor = self._conn.execute(query, args)
+
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(batch_size)
+
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield row
+
+        finally:
+            cursor.close()
+
+    def sync(self, arcdb, batch_size=fetch_batch_size):
+        """Update the cache from the database, via the given ArcDB object.
+
+        Returns the number of COMMON rows fetched.
+        """
+
+        date_end = int((
+            datetime.now(UTC) - timedelta(days=self.recent_days)
+        ).strftime('%Y%m%d'))
+
+        conditions = ['c.utdate <= %(de)s']
+        args = {'de': date_end}
+
+        if self.date_start is not None:
+            conditions.append('c.utdate >= %(ds)s')
+            args['ds'] = self.date_start
+
+        previous_end = self.get_date_end()
+        last_modified = self._state.get('last_modified')
+
+        if previous_end is not None:
+            if last_modified is None:
+                conditions.append('c.utdate > %(pe)s')
+            else:
+                conditions.append(
+                    '(c.utdate > %(pe)s OR c.last_modified >= %(lm)s)')
+                args['lm'] = (
+                    _convert_datetime(last_modified.encode('ascii')) -
+                    timedelta(minutes=self.modified_margin)).isoformat(' ')
+
+            args['pe'] = previous_end
+
+        where = ' WHERE ' + ' AND '.join(conditions)
+
+        n_rows = 0
+
+        with self._lock:
+            try:
+                # Read all tables in one transaction so that the child
+                # table rows are consistent with the COMMON rows.
+                with arcdb.db.transaction() as c:
+                    c.execute(
+                        'SELECT c.* FROM jcmt.COMMON AS c' + where, args)
+
+                    for rows in self._fetch_table(c, 'COMMON', batch_size):
+                        n_rows += len(rows)
+
+                        obsids = [x[0] for x in rows]
+                        for table in cached_tables[1:]:
+                            self._delete_obsids(table, obsids)
+
+                        for row in rows:
+                            if (last_modified is None
+                                    or row[1] > last_modified):
+                                last_modified = row[1]
+
+                    for table in cached_tables[1:]:
+                        c.execute(
+                            'SELECT t.* FROM jcmt.{} AS t'
+                            ' JOIN jcmt.COMMON AS c'
+                            ' ON t.obsid=c.obsid'.format(table) + where,
+                            args)
+
+                        for rows in self._fetch_table(c, table, batch_size):
+                            pass
+
+                self._set_state('date_start', self.date_start)
+                self._set_state('date_end', date_end)
+                self._set_state('last_modified', last_modified)
+
+                self._conn.commit()
+
+            except:
+                self._conn.rollback()
+                self._state = dict(self._conn.execute(
+                    'SELECT name, value FROM jcmt.sync_state').fetchall())
+                raise
+
+        logger.debug(
+            'Header cache synchronized to %i: %i observations fetched',
+            date_end, n_rows)
+
+        return n_rows
+
+    def _fetch_table(self, cursor, table, batch_size):
+        """Copy rows from a MySQL cursor into the cache.
+
+        The table is created if it does not already exist.
+        Generates, for each batch, a list of (obsid, last_modified)
+        tuples (for COMMON) or of obsids (for other tables).
+        """
+
+        columns = [x[0] for x in cursor.description]
+
+        self._create_table(table, cursor.description)
+
+        insert = 'INSERT {}INTO jcmt.{} ({}) VALUES ({})'.format(
+            ('OR REPLACE ' if table == 'COMMON' else ''), table,
+            ', '.join(columns), ', '.join('?' for x in columns))
+
+        i_obsid = columns.index('obsid')
+        i_last_modified = (
+            columns.index('last_modified') if table == 'COMMON' else None)
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            self._conn.executemany(
+                insert, [[_adapt_value(x) for x in row] for row in rows])
+
+            if i_last_modified is None:
+                yield [row[i_obsid] for row in rows]
+            else:
+                yield [
+                    (row[i_obsid], _adapt_value(row[i_last_modified]))
+                    for row in rows]
+
+    def _create_table(self, table, description):
+        """Create a cache table to hold rows with the given description."""
+
+        self._conn.execute('CREATE TABLE IF NOT EXISTS jcmt.{} ({})'.format(
+            table, ', '.join(
+                '{} {}'.format(x[0], _column_types.get(x[1], 'TEXT'))
+                for x in description)))
+
+        if table == 'COMMON':
+            self._conn.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS '
+                'jcmt.COMMON_obsid ON COMMON (obsid)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS '
+                'jcmt.COMMON_utdate ON COMMON (utdate)')
+        else:
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS '
+                'jcmt.{0}_obsid ON {0} (obsid)'.format(table))
+
+    def _delete_obsids(self, table, obsids):
+        """Delete rows for the given obsids from a cache table, if the
+        table exists."""
+
+        if not self._conn.execute(
+                'SELECT name FROM jcmt.sqlite_master '
+                "WHERE type='table' AND name=?", (table,)).fetchall():
+            return
+
+        for chunk in _chunked(obsids, _sqlite_chunk_size):
+            self._conn.execute(
+                'DELETE FROM jcmt.{} WHERE obsid IN ({})'.format(
+                    table, ', '.join('?' for x in chunk)),
+                chunk)
+
+    def _set_state(self, name, value):
+        value = None if value is None else str(value)
+
+        self._conn.execute(
+            'INSERT OR REPLACE INTO jcmt.sync_state (name, value) '
+            'VALUES (?, ?)', (name, value))
+
+        self._state[name] = value
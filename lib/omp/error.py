@@ -21,3 +21,12 @@ class OMPDBError(OMPError):
     """
 
     pass
+
+
+class OMPDBTransientError(OMPDBError):
+    """
+    Class for OMP DB errors which may not recur if the operation
+    is repeated, such as loss of the connection or a deadlock.
+    """
+
+    pass
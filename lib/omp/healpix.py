@@ -16,11 +16,15 @@
 
 from __future__ import print_function, division, absolute_import
 
+from collections import deque
 from math import ceil, pi, sqrt
+from multiprocessing import Pool
+import re
 from sys import stderr
 
 import numpy as np
-from healpy.pixelfunc import ang2pix, nside2resol
+from healpy import query_polygon
+from healpy.pixelfunc import ang2pix, ang2vec, nside2resol
 from pymoc import MOC
 
 
@@ -28,37 +32,194 @@ from pymoc import MOC
 # HEALPix pixels to avoid missing any.
 size_factor = 4
 
+# Number of pending cells after which a CellAccumulator merges them
+# into its set of distinct cells.
+merge_threshold = 4000000
+
+# Number of observations to process in each batch when using
+# multiple processes.
+parallel_batch_size = 100
+
+# Maximum number of mesh points along each side of a rectangle.
+max_mesh_size = 6000
+
+# Maximum number of points to generate at once when meshing
+# multiple rectangles.
+max_mesh_points = 4000000
+
+# Name used for the group of observations with a NULL group value.
+null_group_name = '<NULL>'
+
+
+class CellAccumulator(object):
+    """
+    Accumulate a set of distinct HEALPix cells.
+
+    Arrays of cells are buffered until the number pending reaches
+    the merge threshold, at which point they are merged into the sorted
+    array of distinct cells seen so far.  Memory use therefore depends
+    on the number of distinct cells rather than the total number added.
+    """
+
+    def __init__(self, threshold=merge_threshold):
+        self.threshold = threshold
+        self.cells = None
+        self.pending = []
+        self.n_pending = 0
+
+    def add(self, cells):
+        """
+        Add an array of cells.
+        """
+
+        self.pending.append(cells)
+        self.n_pending += len(cells)
+
+        if self.n_pending >= self.threshold:
+            self.merge()
+
+    def merge(self):
+        """
+        Merge the pending cells into the array of distinct cells.
+        """
+
+        if not self.pending:
+            return
+
+        arrays = self.pending
+        if self.cells is not None:
+            arrays.append(self.cells)
+
+        self.cells = np.unique(np.concatenate(arrays))
+        self.pending = []
+        self.n_pending = 0
+
+    def get_cells(self):
+        """
+        Get a sorted array of the distinct cells, or None if no cells
+        have been added.
+        """
+
+        self.merge()
+
+        return self.cells
+
+
+class GroupedCellAccumulator(object):
+    """
+    Accumulate sets of distinct HEALPix cells for a number of groups.
+
+    The merge threshold applies to the total number of pending cells
+    across all of the groups.  When it is reached, the groups with the
+    most pending cells are merged until no more than half of the threshold
+    remain pending.  Memory use is therefore limited even when there are
+    many groups, none of which reaches the threshold by itself.
+    """
+
+    def __init__(self, threshold=merge_threshold):
+        self.threshold = threshold
+        self.groups = {}
+        self.n_pending = 0
+
+    def add(self, group, cells):
+        """
+        Add an array of cells to the given group.
+        """
+
+        group_cells = self.groups.get(group)
+        if group_cells is None:
+            group_cells = self.groups[group] = CellAccumulator(
+                threshold=self.threshold)
+
+        n_pending = group_cells.n_pending
+        group_cells.add(cells)
+        self.n_pending += group_cells.n_pending - n_pending
+
+        if self.n_pending >= self.threshold:
+            self.merge()
+
+    def merge(self):
+        """
+        Merge the pending cells of the largest groups until no more
+        than half of the threshold remain pending.
+        """
+
+        for group_cells in sorted(
+                self.groups.values(), key=lambda x: x.n_pending,
+                reverse=True):
+            if 2 * self.n_pending <= self.threshold:
+                break
+
+            self.n_pending -= group_cells.n_pending
+            group_cells.merge()
+
+    def get_cells(self):
+        """
+        Get a dictionary of sorted arrays of the distinct cells
+        of each group.
+        """
+
+        self.n_pending = 0
+
+        return {
+            group: group_cells.get_cells()
+            for (group, group_cells) in self.groups.items()}
+
+
+def obs_bounds_to_moc(order, obs_bounds, project_info=False,
+                      processes=None, batch_size=parallel_batch_size,
+                      method='mesh'):
+    """
+    Construct a MOC from observation bounds.
+
+    The obs_bounds argument can be any iterable of rows as returned by
+    ArcDB.get_obs_bounds, including the generator returned when its
+    iterate option is used.  The rows are consumed one at a time.
+
+    If project_info is specified, the project must be given after the
+    8 coordinates of each row, and a (moc, projects) tuple is returned.
+
+    If a number of processes is specified, batches of observations
+    (of the given size) are converted to HEALPix cells in a pool
+    of worker processes.
+
+    The method can be "mesh", to use rectangle_to_healpix, or "polygon"
+    to use rectangle_to_healpix_polygon.
+    """
+
+    if method not in rectangle_methods:
+        raise ValueError('Unknown rectangle method {0}'.format(method))
 
-def obs_bounds_to_moc(order, obs_bounds, project_info=False):
     nside = 2 ** order
-    cells = None
+    cells = CellAccumulator()
     projects = set()
 
-    for obs_bound in obs_bounds:
-        rectangle = obs_bound[0:8]
-        if None in rectangle:
-            continue
+    def rectangles():
+        for obs_bound in obs_bounds:
+            rectangle = obs_bound[0:8]
+            if None in rectangle:
+                continue
 
-        if project_info:
-            projects.add(obs_bound[8])
+            if project_info:
+                projects.add(obs_bound[8])
 
-        try:
-            obs_cells = rectangle_to_healpix(nside, True, *rectangle)
+            yield (rectangle, obs_bound[8:])
 
-            if cells is None:
-                cells = obs_cells
-            else:
-                cells = np.concatenate((cells, obs_cells))
-        except ValueError as e:
-            print('ValueError: ' + str(e) + ': ' +
-                  ' '.join([str(x) for x in obs_bound[8:]]),
-                  file=stderr)
+    for (batch_cells, errors) in _map_batches(
+            _rectangles_to_healpix, (nside, method),
+            _batches(rectangles(), batch_size), processes):
+        cells.add(batch_cells)
+
+        for error in errors:
+            print(error, file=stderr)
+
+    cells = cells.get_cells()
 
     if cells is None:
         moc = None
 
     else:
-        moc = MOC(order, np.unique(cells))
+        moc = MOC(order, cells)
 
     if project_info:
         return (moc, projects)
@@ -67,6 +228,217 @@ def obs_bounds_to_moc(order, obs_bounds, project_info=False):
         return moc
 
 
+def obs_bounds_to_mocs(order, obs_bounds, group_index,
+                       processes=None, batch_size=parallel_batch_size,
+                       method='mesh', threshold=merge_threshold):
+    """
+    Construct a MOC for each group of observations from observation bounds.
+
+    The observations are grouped by the value in the given column
+    of each row, e.g. 8 for the project if get_obs_bounds was called
+    with the project_info option.  All groups are constructed in a single
+    pass through the obs_bounds iterable.
+
+    The processes, batch_size and method arguments are as for
+    obs_bounds_to_moc, with each batch containing observations from
+    a single group.
+
+    The threshold gives the total number of pending cells, across
+    all groups, at which to merge cells (see GroupedCellAccumulator).
+
+    Returns a dictionary of MOCs by group.
+    """
+
+    if method not in rectangle_methods:
+        raise ValueError('Unknown rectangle method {0}'.format(method))
+
+    nside = 2 ** order
+    cells = GroupedCellAccumulator(threshold=threshold)
+
+    def batches():
+        pending = {}
+
+        for obs_bound in obs_bounds:
+            rectangle = obs_bound[0:8]
+            if None in rectangle:
+                continue
+
+            group = obs_bound[group_index]
+            batch = pending.get(group)
+            if batch is None:
+                batch = pending[group] = []
+
+            batch.append((rectangle, obs_bound[8:]))
+
+            if len(batch) >= batch_size:
+                yield (group, batch)
+                del pending[group]
+
+        for (group, batch) in pending.items():
+            yield (group, batch)
+
+    for (group, batch_cells, errors) in _map_batches(
+            _grouped_rectangles_to_healpix, (nside, method),
+            batches(), processes):
+        cells.add(group, batch_cells)
+
+        for error in errors:
+            print(error, file=stderr)
+
+    mocs = {}
+
+    for (group, group_cells) in cells.get_cells().items():
+        if group_cells is not None and len(group_cells):
+            mocs[group] = MOC(order, group_cells)
+
+    return mocs
+
+
+def group_file_names(groups):
+    """
+    Determine file names for the MOCs of a set of groups.
+
+    Groups are sorted with None (a NULL value in the database) last, and
+    given file names based on their values with unsafe characters replaced
+    and a number appended where necessary to keep the names distinct
+    (ignoring case).
+
+    Returns a list of (group, name, filename) tuples, where the name is
+    the group as a string, using null_group_name for None.
+    """
+
+    result = []
+    filenames = set()
+
+    for group in sorted(
+            groups, key=lambda x: (x is None, '' if x is None else str(x))):
+        name = null_group_name if group is None else str(group)
+        base = re.sub('[^-+_.A-Za-z0-9]', '_', name)
+        filename = base + '.fits'
+        n = 1
+
+        while filename.lower() in filenames:
+            n += 1
+            filename = '{}_{}.fits'.format(base, n)
+
+        filenames.add(filename.lower())
+        result.append((group, name, filename))
+
+    return result
+
+
+def _batches(iterable, size):
+    """
+    Generate lists of at most the given size from an iterable.
+    """
+
+    batch = []
+
+    for item in iterable:
+        batch.append(item)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _map_batches(function, args, batches, processes):
+    """
+    Apply a function to each batch, optionally using a process pool.
+
+    The function is called with a tuple of the given args followed
+    by the batch.  When using
+    a pool, only a limited number of batches are submitted ahead of
+    the results being consumed, so that the batches iterable is not
+    read into memory all at once.  Results are generated in order.
+    """
+
+    if not processes:
+        for batch in batches:
+            yield function(args + (batch,))
+
+        return
+
+    pool = Pool(processes)
+
+    try:
+        pending = deque()
+
+        for batch in batches:
+            pending.append(pool.apply_async(function, (args + (batch,),)))
+
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _rectangles_to_healpix(args):
+    """
+    Convert a batch of rectangles to HEALPix cells.
+
+    Takes an (nside, method, batch) tuple, where the batch is a list of
+    (rectangle, info) tuples.  Returns a unique array of cells and
+    a list of error messages (including the info for the corresponding
+    rectangle).
+    """
+
+    (nside, method, batch) = args
+    cells = []
+    errors = []
+
+    if method == 'mesh':
+        # Use the vectorised method to process the whole batch at once.
+        (batch_cells, rejected) = rectangles_to_healpix(
+            nside, True, [x[0] for x in batch])
+
+        for ((rectangle, info), is_rejected) in zip(batch, rejected):
+            if is_rejected:
+                errors.append('ValueError: Excessively large rectangle: ' +
+                              ' '.join([str(x) for x in info]))
+
+        return (batch_cells, errors)
+
+    function = rectangle_methods[method]
+
+    for (rectangle, info) in batch:
+        try:
+            cells.append(function(nside, True, *rectangle))
+
+        except ValueError as e:
+            errors.append('ValueError: ' + str(e) + ': ' +
+                          ' '.join([str(x) for x in info]))
+
+    if cells:
+        cells = np.unique(np.concatenate(cells))
+    else:
+        cells = np.array([], dtype=np.int64)
+
+    return (cells, errors)
+
+
+def _grouped_rectangles_to_healpix(args):
+    """
+    Convert a batch of rectangles for a group of observations to
+    HEALPix cells.
+
+    Takes an (nside, method, (group, batch)) tuple and returns
+    a (group, cells, errors) tuple.  See _rectangles_to_healpix.
+    """
+
+    (nside, method, (group, batch)) = args
+
+    return (group,) + _rectangles_to_healpix((nside, method, batch))
+
+
 def rectangle_to_healpix(nside, nest, *rectangle):
     """
     Generate a unique list of HEALPix pixels for the given rectangle.
@@ -82,6 +454,41 @@ def rectangle_to_healpix(nside, nest, *rectangle):
                              ra * pi / 180, nest=nest))
 
 
+def rectangle_to_healpix_polygon(nside, nest, *rectangle):
+    """
+    Generate a unique list of HEALPix pixels for the given rectangle,
+    treating it as a polygon.
+
+    This finds the pixels overlapping the quadrilateral with the
+    given corners directly, rather than sampling a mesh of points,
+    so the cost depends on the number of pixels covered and there
+    is no limit on the size of the rectangle.  If the corners
+    do not form a convex polygon (e.g. because they coincide)
+    then rectangle_to_healpix is used instead.
+    """
+
+    (x_tl, x_bl, x_tr, x_br, y_tl, y_bl, y_tr, y_br) = rectangle
+
+    # Give the corners in order around the perimeter.
+    vertices = ang2vec(
+        np.array([x_tl, x_tr, x_br, x_bl], dtype=np.float64),
+        np.array([y_tl, y_tr, y_br, y_bl], dtype=np.float64),
+        lonlat=True)
+
+    try:
+        return query_polygon(nside, vertices, inclusive=True, nest=nest)
+
+    except RuntimeError:
+        return rectangle_to_healpix(nside, nest, *rectangle)
+
+
+# Functions which can be used to convert rectangles to HEALPix pixels.
+rectangle_methods = {
+    'mesh': rectangle_to_healpix,
+    'polygon': rectangle_to_healpix_polygon,
+}
+
+
 def rectangle_mesh(size, x_tl, x_bl, x_tr, x_br, y_tl, y_bl, y_tr, y_br):
     """
     Generate a mesh of points covering the given area, with the
@@ -110,7 +517,7 @@ def rectangle_mesh(size, x_tl, x_bl, x_tr, x_br, y_tl, y_bl, y_tr, y_br):
     nx = int(ceil(sqrt(max(dd_b, dd_t)) / size)) + 1
     ny = int(ceil(sqrt(max(dd_l, dd_r)) / size)) + 1
 
-    if nx > 6000 or ny > 6000:
+    if nx > max_mesh_size or ny > max_mesh_size:
         raise ValueError('Excessively large rectangle')
 
     fx, fy = np.ogrid[0:1:(nx * 1j), 0:1:(ny * 1j)]
@@ -125,3 +532,124 @@ def rectangle_mesh(size, x_tl, x_bl, x_tr, x_br, y_tl, y_bl, y_tr, y_br):
         fx  * (y_br * fy_ + y_tr * fy)
 
     return x.ravel(), y.ravel()
+
+
+def rectangles_to_healpix(nside, nest, rectangles):
+    """
+    Generate a unique list of HEALPix pixels covering all of the
+    given rectangles.
+
+    The rectangles should be given as an (N, 8) array, or sequence of
+    rectangles, in the same order as the arguments of rectangle_mesh.
+
+    Returns the array of pixels and a boolean array indicating which
+    rectangles were rejected as excessively large.
+    """
+
+    size = nside2resol(nside) * 180 / pi
+
+    cells = []
+
+    (meshes, rejected) = rectangles_mesh(size / size_factor, rectangles)
+
+    for (ra, dec) in meshes:
+        cells.append(np.unique(ang2pix(nside, pi / 2 - dec * pi / 180,
+                                       ra * pi / 180, nest=nest)))
+
+    if cells:
+        cells = np.unique(np.concatenate(cells))
+    else:
+        cells = np.array([], dtype=np.int64)
+
+    return (cells, rejected)
+
+
+def rectangles_mesh(size, rectangles):
+    """
+    Generate meshes of points covering multiple rectangles.
+
+    This is a vectorised equivalent of rectangle_mesh.  The rectangles
+    are grouped by mesh size, with the number of points along each
+    side rounded up (by at most 1/8) so that rectangles of similar size
+    can be processed together.  (The slightly finer mesh means that
+    pixels only just touching the edge of a rectangle may differ from
+    those found via rectangle_mesh.)
+
+    Returns a generator of (x, y) point arrays, each covering a group of
+    rectangles, and a boolean array indicating which rectangles were
+    rejected as excessively large.
+    """
+
+    rectangles = np.array(rectangles, dtype=np.float64).reshape((-1, 8))
+
+    x = rectangles[:, 0:4]
+    y = rectangles[:, 4:8]
+
+    # Check for observations where the RA wraps around.
+    wrap = np.any(x < 60, axis=1)
+    x[wrap] = np.where(x[wrap] > 300, x[wrap] - 360, x[wrap])
+
+    (x_tl, x_bl, x_tr, x_br) = x.T
+    (y_tl, y_bl, y_tr, y_br) = y.T
+
+    dd_b = (x_br - x_bl) ** 2 + (y_br - y_bl) ** 2
+    dd_t = (x_tr - x_tl) ** 2 + (y_tr - y_tl) ** 2
+    dd_l = (x_tl - x_bl) ** 2 + (y_tl - y_bl) ** 2
+    dd_r = (x_tr - x_br) ** 2 + (y_tr - y_br) ** 2
+
+    nx = np.ceil(np.sqrt(np.maximum(dd_b, dd_t)) / size).astype(int) + 1
+    ny = np.ceil(np.sqrt(np.maximum(dd_l, dd_r)) / size).astype(int) + 1
+
+    rejected = (nx > max_mesh_size) | (ny > max_mesh_size)
+
+    return (_rectangles_mesh_groups(
+        x[~rejected], y[~rejected],
+        _mesh_bucket(nx[~rejected]), _mesh_bucket(ny[~rejected])),
+        rejected)
+
+
+def _rectangles_mesh_groups(x, y, nx, ny):
+    """
+    Generate meshes for groups of rectangles with the same mesh size.
+    """
+
+    shapes = np.stack((nx, ny), axis=1)
+
+    for (nx_group, ny_group) in np.unique(shapes, axis=0):
+        index = np.flatnonzero((nx == nx_group) & (ny == ny_group))
+
+        n_group = max(1, max_mesh_points // (nx_group * ny_group))
+
+        fx = np.linspace(0, 1, nx_group).reshape((1, -1, 1))
+        fy = np.linspace(0, 1, ny_group).reshape((1, 1, -1))
+
+        fx_ = 1 - fx
+        fy_ = 1 - fy
+
+        for i in range(0, len(index), n_group):
+            group = index[i:i + n_group]
+
+            (x_tl, x_bl, x_tr, x_br) = (
+                x[group, j].reshape((-1, 1, 1)) for j in range(4))
+            (y_tl, y_bl, y_tr, y_br) = (
+                y[group, j].reshape((-1, 1, 1)) for j in range(4))
+
+            x_group = fy_ * (x_bl * fx_ + x_br * fx) + \
+                fy * (x_tl * fx_ + x_tr * fx)
+
+            y_group = fx_ * (y_bl * fy_ + y_tl * fy) + \
+                fx * (y_br * fy_ + y_tr * fy)
+
+            yield (x_group.ravel(), y_group.ravel())
+
+
+def _mesh_bucket(n):
+    """
+    Round up an array of mesh sizes so that values above 8 take
+    one of 8 values within each power of 2.
+    """
+
+    step = 2 ** np.maximum(
+        0, np.floor(np.log2(np.maximum(n, 1))).astype(int) - 3)
+
+    return ((n + step - 1) // step) * step
@@ -0,0 +1,188 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Note: this test requires Python 3.  A stub aiomysql module is installed
+# so that the omp.db.aio module can be tested without the package
+# or a database server.
+
+import asyncio
+from datetime import datetime
+import sys
+import types
+from unittest import TestCase
+
+from omp.db.db import QueryPlan
+from omp.error import OMPDBError
+
+
+class StubError(Exception):
+    pass
+
+
+class StubCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+        self.rows = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type_, value, tb):
+        pass
+
+    async def execute(self, query, args):
+        self.conn.pool.queries.append((query, args))
+        result = self.conn.pool.respond(query, args)
+        if isinstance(result, Exception):
+            raise result
+        self.rows = result
+
+    async def fetchall(self):
+        # Yield to the event loop so that concurrent plans interleave.
+        await asyncio.sleep(0)
+        return self.rows
+
+
+class StubConnection(object):
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        return StubCursor(self)
+
+    async def rollback(self):
+        self.pool.n_rollback += 1
+
+
+class StubAcquire(object):
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        self.pool.n_acquire += 1
+        return StubConnection(self.pool)
+
+    async def __aexit__(self, type_, value, tb):
+        pass
+
+
+class StubPool(object):
+    def __init__(self, respond):
+        self.respond = respond
+        self.queries = []
+        self.n_acquire = 0
+        self.n_rollback = 0
+        self.closed = False
+
+    def acquire(self):
+        return StubAcquire(self)
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+def respond(query, args):
+    if 'omptimeacct' in query:
+        return [(datetime(2026, 1, 1), 3600, 1)]
+    elif 'ompfault' in query:
+        return [('m26ap001', 20260101001, 0, 'Fault')]
+    elif 'error' in query:
+        return StubError('query failed')
+    return []
+
+
+stub = types.ModuleType('aiomysql')
+stub.Error = StubError
+stub.pools = []
+
+
+async def create_pool(**kwargs):
+    pool = StubPool(respond)
+    stub.pools.append(pool)
+    return pool
+
+
+stub.create_pool = create_pool
+
+_previous = sys.modules.get('aiomysql')
+sys.modules['aiomysql'] = stub
+try:
+    from omp.db.aio import AsyncOMPDB
+finally:
+    if _previous is None:
+        del sys.modules['aiomysql']
+    else:
+        sys.modules['aiomysql'] = _previous
+
+
+class AsyncOMPDBTest(TestCase):
+    def test_gather(self):
+        async def run():
+            async with AsyncOMPDB(server='s', user='u', password='p') as db:
+                pool = db._pool
+                result = await asyncio.gather(
+                    db.get_time_charged_project_info('M26AP001'),
+                    db.get_fault_summary('M26AP001'))
+
+            self.assertIsNone(db._pool)
+            self.assertTrue(pool.closed)
+            return (pool, result)
+
+        (pool, (timeinfo, faults)) = asyncio.run(run())
+
+        self.assertEqual(len(timeinfo), 1)
+        self.assertEqual(timeinfo[0].timespent, 3600)
+        self.assertEqual(len(faults), 1)
+        self.assertEqual(faults[0].faultid, 20260101001)
+
+        self.assertEqual(pool.n_acquire, 2)
+        self.assertEqual(pool.n_rollback, 2)
+        self.assertEqual(pool.queries[0][1], {'p': 'M26AP001'})
+        self.assertEqual(pool.queries[1][1], {'p': 'm26ap001'})
+
+    def test_fetch_plan(self):
+        async def run(plan):
+            db = AsyncOMPDB(server='s', user='u', password='p')
+
+            with self.assertRaisesRegex(OMPDBError, 'not open'):
+                await db._fetch_plan(plan)
+
+            await db.open()
+
+            try:
+                await db._fetch_plan(plan)
+            finally:
+                await db.close()
+
+        # Only select queries are permitted, and the connection
+        # is rolled back even if the plan fails.
+        with self.assertRaisesRegex(OMPDBError, 'non-select'):
+            asyncio.run(run(QueryPlan(
+                [('SELECT 1', {}), ('UPDATE omp.ompproj SET x=1', {})],
+                None)))
+
+        pool = stub.pools[-1]
+        self.assertEqual(pool.queries, [('SELECT 1', {})])
+        self.assertEqual(pool.n_rollback, 1)
+
+        # Database errors are converted to OMPDBError.
+        with self.assertRaisesRegex(OMPDBError, 'query failed'):
+            asyncio.run(run(QueryPlan([('SELECT error', {})], None)))
+
+        self.assertEqual(stub.pools[-1].n_rollback, 1)
@@ -0,0 +1,323 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Event, Thread
+from time import sleep
+from unittest import TestCase
+
+import mysql.connector
+from mysql.connector import errorcode
+
+import omp.db.backend.mysql as backend
+from omp.db.backend.mysql import OMPMySQLLock, OMPMySQLPool
+from omp.db.db import OMPDB
+from omp.db.instrument import HistogramSink, QueryInstrument
+from omp.error import OMPDBError, OMPDBTransientError
+
+
+class DummyCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.queries = []
+        self.description = None
+
+    def execute(self, query, params=None):
+        if self.conn.fail:
+            self.conn.fail -= 1
+            raise mysql.connector.errors.OperationalError(
+                errno=errorcode.CR_SERVER_LOST)
+
+        self.conn.queries.append(query)
+
+    def fetchall(self):
+        if self.conn.results:
+            return self.conn.results.pop(0)
+
+        return [(1,), (2,)]
+
+    def fetchmany(self, size=1):
+        return []
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class DummyConnection(object):
+    def __init__(self, **kwargs):
+        self.queries = []
+        self.connected = True
+        self.n_commit = 0
+        self.n_rollback = 0
+        self.n_ping = 0
+        self.n_reconnect = 0
+        self.fail = 0
+        self.results = []
+
+    def ping(self, **kwargs):
+        self.n_ping += 1
+
+    def reconnect(self, **kwargs):
+        self.n_reconnect += 1
+
+    def cursor(self):
+        return DummyCursor(self)
+
+    def commit(self):
+        self.n_commit += 1
+
+    def rollback(self):
+        self.n_rollback += 1
+
+    def is_connected(self):
+        return self.connected
+
+    def close(self):
+        self.connected = False
+
+
+class BackendTestCase(TestCase):
+    def setUp(self):
+        self.connections = []
+
+        def connect(**kwargs):
+            conn = DummyConnection(**kwargs)
+            self.connections.append(conn)
+            return conn
+
+        self.orig_connect = mysql.connector.connect
+        backend.mysql.connector.connect = connect
+
+    def tearDown(self):
+        backend.mysql.connector.connect = self.orig_connect
+
+
+class LockTest(BackendTestCase):
+    def test_transaction(self):
+        db = OMPMySQLLock('server', 'user', 'password')
+
+        with db.transaction() as c:
+            c.execute('SELECT 1')
+
+            with self.assertRaises(OMPDBError):
+                c.execute('DELETE FROM x')
+
+        with db.transaction(read_write=True) as c:
+            c.execute('DELETE FROM x')
+
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.connections[0].n_commit, 1)
+        self.assertEqual(db.get_status()[0]['use'], 2)
+
+        # Only the first transaction should have pinged the server.
+        self.assertEqual(self.connections[0].n_ping, 1)
+        self.assertEqual(db.get_stats()['ping'], 1)
+        self.assertEqual(db.get_stats()['ping_skipped'], 1)
+
+        db = OMPMySQLLock('server', 'user', 'password', read_only=True)
+
+        with self.assertRaises(OMPDBError):
+            with db.transaction(read_write=True) as c:
+                pass
+
+    def test_reconnect(self):
+        db = OMPMySQLLock('server', 'user', 'password')
+        conn = self.connections[0]
+
+        # Failure of the first query is retried transparently.
+        conn.fail = 1
+        with db.transaction() as c:
+            c.execute('SELECT 1')
+
+        self.assertEqual(conn.queries, ['SELECT 1'])
+        self.assertEqual(conn.n_reconnect, 1)
+        self.assertEqual(db.get_stats()['reconnect'], 1)
+
+        # But later queries are not.
+        with self.assertRaises(OMPDBTransientError):
+            with db.transaction() as c:
+                c.execute('SELECT 2')
+                conn.fail = 1
+                c.execute('SELECT 3')
+
+        self.assertEqual(conn.n_reconnect, 1)
+
+        # The lost connection is re-established for the next transaction.
+        with db.transaction() as c:
+            c.execute('SELECT 4')
+
+        self.assertEqual(conn.n_reconnect, 2)
+        self.assertEqual(conn.queries, ['SELECT 1', 'SELECT 2', 'SELECT 4'])
+
+
+class InstrumentTest(BackendTestCase):
+    def test_instrument(self):
+        records = []
+
+        class ListSink(object):
+            def record(self, record):
+                records.append(record)
+
+        histogram = HistogramSink()
+        instrument = QueryInstrument(
+            sinks=[ListSink(), histogram], slow_threshold=None)
+
+        db = OMPMySQLLock(
+            'server', 'user', 'password', instrument=instrument)
+
+        def get_things():
+            with db.transaction() as c:
+                c.execute('SELECT 1')
+                c.fetchall()
+                c.execute('SELECT 2')
+
+        get_things()
+
+        self.assertEqual([x.query for x in records], ['SELECT 1', 'SELECT 2'])
+        self.assertEqual([x.rows for x in records], [2, 0])
+        self.assertEqual(records[0].method, None)
+        self.assertFalse(records[0].slow)
+
+        stats = histogram.get_stats()
+        self.assertEqual(stats[None]['count'], 2)
+        self.assertEqual(stats[None]['rows'], 2)
+        self.assertIn('Queries', instrument.report())
+
+    def test_instrument_method(self):
+        records = []
+
+        class ListSink(object):
+            def record(self, record):
+                records.append(record)
+
+        instrument = QueryInstrument(sinks=[ListSink()], slow_threshold=0.0)
+
+        db = OMPDB(
+            server='server', user='user', password='password',
+            instrument=instrument)
+
+        self.connections[0].results = [
+            [('u1', 'User One', 'u1@example.com', None, 1, 'PI')],
+            [('M26AP001', 'Title', '26A', 'EAO', 10.0, 5.0,
+              0.0, 0.1, 1)],
+        ]
+
+        info = db.get_project_info('M26AP001')
+        self.assertEqual(info.pi[0].userid, 'u1')
+
+        self.assertEqual(len(records), 2)
+        self.assertEqual(
+            [x.method for x in records],
+            ['OMPDB.get_project_info', 'OMPDB.get_project_info'])
+
+        # The wall time ends at the last fetch, with the remainder
+        # attributed to the caller, and slowness is judged on the time
+        # spent executing and fetching.
+        for record in records:
+            self.assertEqual(record.rows, 1)
+            self.assertGreaterEqual(
+                record.wall, record.execute + record.fetch)
+            self.assertGreaterEqual(record.caller, 0.0)
+            self.assertEqual(
+                record.slow, record.execute + record.fetch > 0.0)
+
+        # Time spent by the caller does not make a query slow.
+        del records[:]
+        instrument.slow_threshold = 0.05
+
+        with db.db.transaction() as c:
+            c.execute('SELECT 1')
+            c.fetchall()
+            sleep(0.1)
+
+        self.assertEqual(len(records), 1)
+        self.assertFalse(records[0].slow)
+        self.assertLess(records[0].wall, 0.05)
+        self.assertGreaterEqual(records[0].caller, 0.1)
+
+
+class PoolTest(BackendTestCase):
+    def test_concurrent(self):
+        db = OMPMySQLPool('server', 'user', 'password', pool_size=2)
+
+        started = Event()
+        release = Event()
+
+        def hold():
+            with db.transaction() as c:
+                c.execute('SELECT 1')
+                started.set()
+                release.wait(5)
+
+        thread = Thread(target=hold)
+        thread.start()
+        started.wait(5)
+
+        # A second transaction can proceed while the first is open.
+        with db.transaction() as c:
+            c.execute('SELECT 2')
+
+            self.assertEqual(db.get_status()['in_use'], 2)
+
+        release.set()
+        thread.join()
+
+        status = db.get_status()
+        self.assertEqual(status['open'], 2)
+        self.assertEqual(status['in_use'], 0)
+        self.assertEqual(len(self.connections), 2)
+
+        db.close()
+
+        self.assertEqual(db.get_status()['open'], 0)
+        self.assertFalse(any(x.connected for x in self.connections))
+
+        with self.assertRaises(OMPDBError):
+            with db.transaction() as c:
+                pass
+
+    def test_checkout_timeout(self):
+        db = OMPMySQLPool(
+            'server', 'user', 'password', pool_size=1, checkout_timeout=0.1)
+
+        with db.transaction() as c:
+            with self.assertRaises(OMPDBError):
+                with db.transaction() as c2:
+                    pass
+
+        # Connection is reused after being returned.
+        with db.transaction() as c:
+            pass
+
+        self.assertEqual(len(self.connections), 1)
+
+    def test_unhealthy(self):
+        db = OMPMySQLPool('server', 'user', 'password', pool_size=1)
+
+        with self.assertRaises(OMPDBError):
+            with db.transaction() as c:
+                c.execute('SELECT 1')
+                self.connections[0].fail = 1
+                c.execute('SELECT 2')
+
+        self.assertEqual(db.get_status()['discarded'], 1)
+
+        with db.transaction() as c:
+            pass
+
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(db.get_stats()['use'], 2)
@@ -0,0 +1,88 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+
+from omp.db.cache import OMPDBCache
+
+from .test_omp_db import make_ompdb
+
+
+class CacheTest(TestCase):
+    def test_cache(self):
+        cache = OMPDBCache(max_entries=2)
+
+        cache.set(('a', (1,), ()), [1])
+        cache.set(('b', (2,), ()), [2])
+
+        (found, value) = cache.get(('a', (1,), ()))
+        self.assertTrue(found)
+        self.assertEqual(value, [1])
+
+        # Returned values are copies of the cached value.
+        value.append(3)
+        self.assertEqual(cache.get(('a', (1,), ()))[1], [1])
+
+        # Adding a third entry evicts the least recently used one.
+        cache.set(('c', (3,), ()), [3])
+        self.assertFalse(cache.get(('b', (2,), ()))[0])
+        self.assertTrue(cache.get(('a', (1,), ()))[0])
+
+        # Copies include nested values.
+        cache = OMPDBCache()
+        cache.set(('d', (4,), ()), {'pi': ['X']})
+        value = cache.get(('d', (4,), ()))[1]
+        value['pi'].append('Y')
+        self.assertEqual(cache.get(('d', (4,), ()))[1], {'pi': ['X']})
+
+        # A zero TTL disables caching for that method.
+        cache = OMPDBCache(ttl={'a': 0})
+        cache.set(('a', (1,), ()), [1])
+        self.assertFalse(cache.get(('a', (1,), ()))[0])
+
+    def test_invalidate(self):
+        cache = OMPDBCache()
+
+        cache.set(('a', ('P1',), ()), 1, project='P1')
+        cache.set(('a', ('p1',), ()), 1, project='p1')
+        cache.set(('a', ('P2',), ()), 2, project='P2')
+        cache.set(('b', (), ()), 3)
+
+        # Project codes are matched case-insensitively.
+        cache.invalidate(projects=['p1'])
+
+        self.assertFalse(cache.get(('a', ('P1',), ()))[0])
+        self.assertFalse(cache.get(('a', ('p1',), ()))[0])
+        self.assertTrue(cache.get(('a', ('P2',), ()))[0])
+        self.assertFalse(cache.get(('b', (), ()))[0])
+
+        cache.invalidate(method='a')
+        self.assertFalse(cache.get(('a', ('P2',), ()))[0])
+
+    def test_cached_method(self):
+        db = make_ompdb([
+            (None, [('M26AP001',), ('M26AP002',)]),
+            (None, [('M26AP003',)]),
+        ])
+
+        self.assertEqual(db.get_projectids('26A'), ['M26AP001', 'M26AP002'])
+
+        db.cache = OMPDBCache()
+
+        for i in range(2):
+            self.assertEqual(db.get_projectids('26A'), ['M26AP003'])
+
+        self.assertEqual(len(db.db.cursor.queries), 2)
+        self.assertEqual(db.cache.get_stats()['hit'], 1)
@@ -0,0 +1,206 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+from decimal import Decimal
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from mysql.connector import FieldType
+
+from omp.db.part.arc import ArcDB
+from omp.db.part.header_cache import ArcHeaderCache
+from omp.error import OMPDBError
+
+from .test_omp_db import make_ompdb
+
+common_description = [
+    ('obsid', FieldType.VAR_STRING),
+    ('last_modified', FieldType.DATETIME),
+    ('utdate', FieldType.LONG),
+    ('instrume', FieldType.VAR_STRING),
+    ('project', FieldType.VAR_STRING),
+    ('release_date', FieldType.DATETIME),
+]
+
+acsis_description = [
+    ('obsid', FieldType.VAR_STRING),
+    ('subsysnr', FieldType.LONG),
+    ('restfreq', FieldType.NEWDECIMAL),
+]
+
+scuba2_description = [
+    ('obsid', FieldType.VAR_STRING),
+    ('obsid_subsysnr', FieldType.VAR_STRING),
+    ('filter', FieldType.VAR_STRING),
+    ('wavelen', FieldType.DOUBLE),
+    ('bandwid', FieldType.DOUBLE),
+]
+
+
+class HeaderCacheTest(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.filename = os.path.join(self.directory, 'headers.sqlite')
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def _sync(self, cache, common=[], acsis=[], scuba2=[]):
+        arcdb = make_ompdb([
+            (common_description, common),
+            (acsis_description, acsis),
+            (scuba2_description, scuba2),
+        ], cls=ArcDB)
+
+        n_rows = cache.sync(arcdb)
+
+        return (n_rows, arcdb.db.cursor.queries)
+
+    def test_sync(self):
+        cache = ArcHeaderCache(self.filename, date_start=20200101)
+
+        self.assertFalse(cache.covers(20200101, 20200102))
+
+        (n_rows, queries) = self._sync(cache, common=[
+            ('acsis_1', datetime(2020, 1, 3, 10, 0, 0), 20200102, 'HARP',
+             'M20AP001', datetime(2021, 1, 1)),
+            ('acsis_2', datetime(2020, 1, 4, 10, 0, 0), 20200103, 'HARP',
+             'M20AP001', datetime(2021, 1, 2)),
+        ], acsis=[
+            ('acsis_1', 1, Decimal('345.796')),
+            ('acsis_1', 2, Decimal('330.588')),
+            ('acsis_2', 1, Decimal('345.796')),
+        ])
+
+        self.assertEqual(n_rows, 2)
+        self.assertNotIn('last_modified', queries[0][0])
+        self.assertEqual(queries[0][1]['ds'], 20200101)
+
+        self.assertTrue(cache.covers(20200101, 20200103))
+        self.assertFalse(cache.covers(None, 20200103))
+        self.assertFalse(cache.covers(20200101, None))
+        self.assertFalse(cache.covers(20191231, 20200103))
+
+        # Queries are translated from MySQL style.
+        self.assertEqual(cache.read(
+            'SELECT obsid, release_date FROM jcmt.COMMON '
+            'WHERE utdate >= %(s)s AND project NOT LIKE \'%%EC%%\' '
+            'ORDER BY obsid', {'s': 20200103}), [
+                ('acsis_2', datetime(2021, 1, 2))])
+
+        self.assertEqual(cache.find_obsids(['acsis_1', 'acsis_3']),
+                         set(['acsis_1']))
+
+        # Obsid lookups are split to stay within SQLite's parameter limit.
+        self.assertEqual(
+            cache.read_obsids(
+                'ACSIS', ['subsysnr'],
+                ['acsis_{}'.format(i) for i in range(3, 1200)] + ['acsis_2']),
+            [('acsis_2', 1)])
+
+        # Reopen the cache and update it, replacing the child rows
+        # of a modified observation.
+        cache.close()
+        cache = ArcHeaderCache(self.filename, date_start=20200101)
+
+        (n_rows, queries) = self._sync(cache, common=[
+            ('acsis_1', datetime(2020, 1, 5, 10, 0, 0), 20200102, 'HARP',
+             'M20AP001', datetime(2021, 1, 1)),
+        ], acsis=[
+            ('acsis_1', 1, Decimal('345.796')),
+        ])
+
+        self.assertEqual(n_rows, 1)
+        self.assertIn('last_modified', queries[0][0])
+        self.assertEqual(queries[0][1]['lm'], '2020-01-04 09:55:00')
+
+        self.assertEqual(cache.read(
+            'SELECT obsid, COUNT(*) FROM jcmt.ACSIS GROUP BY obsid '
+            'ORDER BY obsid', {}), [('acsis_1', 1), ('acsis_2', 1)])
+
+        cache.close()
+
+    def test_sync_late_commit(self):
+        cache = ArcHeaderCache(
+            self.filename, date_start=20200101, modified_margin=10)
+
+        self._sync(cache, common=[
+            ('acsis_1', datetime(2020, 1, 3, 10, 0, 0), 20200102, 'HARP',
+             'M20AP001', datetime(2021, 1, 1)),
+        ])
+
+        # A row modified before the most recent one, but committed after
+        # the previous synchronization, is still selected.
+        (n_rows, queries) = self._sync(cache, common=[
+            ('acsis_2', datetime(2020, 1, 3, 9, 58, 0), 20200102, 'HARP',
+             'M20AP001', datetime(2021, 1, 1)),
+        ])
+
+        self.assertEqual(n_rows, 1)
+        self.assertEqual(queries[0][1]['lm'], '2020-01-03 09:50:00')
+        self.assertEqual(
+            cache.find_obsids(['acsis_1', 'acsis_2']),
+            set(['acsis_1', 'acsis_2']))
+
+        # The mark is not moved back by the late row.
+        (n_rows, queries) = self._sync(cache)
+
+        self.assertEqual(queries[0][1]['lm'], '2020-01-03 09:50:00')
+
+        cache.close()
+
+        with self.assertRaises(OMPDBError):
+            ArcHeaderCache(self.filename, date_start=20190101)
+
+    def test_arcdb(self):
+        cache = ArcHeaderCache(self.filename)
+
+        self._sync(cache, common=[
+            ('scuba2_1', datetime(2020, 1, 3, 10, 0, 0), 20200102,
+             'SCUBA-2', 'M20AP002', datetime(2021, 1, 1)),
+        ], scuba2=[
+            ('scuba2_1', 'scuba2_1_850', '850', 8.5e-4, 8.5e-5),
+        ])
+
+        db = make_ompdb([
+            (None, [('scuba2_2', 'scuba2_2_450', '450', 4.5e-4, 3.2e-5)]),
+            (None, [('acsis_3', datetime(2021, 1, 3))]),
+        ], cls=ArcDB)
+        db.header_cache = cache
+
+        # Cached observations are read from the cache.
+        result = db.query_table_many('SCUBA2', ['scuba2_1', 'scuba2_2'])
+        self.assertEqual(result['scuba2_1'], [{
+            'obsid_subsysnr': 'scuba2_1_850', 'filter': '850',
+            'wavelen': 8.5e-4, 'bandwid': 8.5e-5}])
+        self.assertEqual(
+            [x['filter'] for x in result['scuba2_2']], ['450'])
+        self.assertEqual(db.db.cursor.queries[0][1], {'o0': 'scuba2_2'})
+
+        self.assertEqual(
+            db.find_obs_by_date(20200101, 20200110, instrument='scuba-2'),
+            ['scuba2_1'])
+
+        # Date ranges extending beyond the cache use the database.
+        self.assertEqual(
+            db.find_releasedates(20200101, 29991231),
+            [('acsis_3', datetime(2021, 1, 3))])
+
+        self.assertEqual(len(db.db.cursor.queries), 2)
+
+        cache.close()
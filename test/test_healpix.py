@@ -0,0 +1,191 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+
+from math import pi
+
+from healpy.pixelfunc import ang2pix
+import numpy as np
+
+from omp.healpix import \
+    CellAccumulator, GroupedCellAccumulator, group_file_names, null_group_name, \
+    obs_bounds_to_moc, obs_bounds_to_mocs, \
+    rectangle_to_healpix, rectangle_to_healpix_polygon, rectangles_to_healpix
+
+
+def cell(order, ra, dec):
+    return ang2pix(2 ** order, pi / 2 - dec * pi / 180, ra * pi / 180,
+                   nest=True)
+
+
+class CellAccumulatorTest(TestCase):
+    def test_accumulate(self):
+        acc = CellAccumulator(threshold=5)
+
+        self.assertIsNone(acc.get_cells())
+
+        acc.add(np.array([5, 3, 1]))
+        self.assertEqual(acc.n_pending, 3)
+
+        acc.add(np.array([3, 7]))
+        self.assertEqual(acc.n_pending, 0)
+        self.assertEqual(acc.cells.tolist(), [1, 3, 5, 7])
+
+        acc.add(np.array([2, 7]))
+        self.assertEqual(acc.get_cells().tolist(), [1, 2, 3, 5, 7])
+
+    def test_accumulate_grouped(self):
+        acc = GroupedCellAccumulator(threshold=10)
+
+        # Many small groups, none of which reaches the threshold alone.
+        for group in range(6):
+            acc.add(group, np.arange(group + 1))
+
+        # Each time the pending total reached 10, the largest groups
+        # were merged until at most 5 remained.
+        self.assertEqual(acc.n_pending, 3)
+        for group in range(2, 6):
+            self.assertEqual(acc.groups[group].n_pending, 0)
+        self.assertEqual(acc.groups[3].cells.tolist(), [0, 1, 2, 3])
+        self.assertEqual(acc.groups[1].n_pending, 2)
+        self.assertIsNone(acc.groups[1].cells)
+
+        acc.add(0, np.array([5]))
+        self.assertEqual(acc.n_pending, 4)
+
+        cells = acc.get_cells()
+        self.assertEqual(acc.n_pending, 0)
+        self.assertEqual(sorted(cells.keys()), list(range(6)))
+        self.assertEqual(cells[0].tolist(), [0, 5])
+        self.assertEqual(cells[5].tolist(), list(range(6)))
+
+
+class ObsBoundsTest(TestCase):
+    # Rectangles given as (RA TL, BL, TR, BR, Dec TL, BL, TR, BR).
+    obs_bounds = [
+        (10.1, 10.1, 10.0, 10.0, 20.1, 20.0, 20.1, 20.0, 'A'),
+        (359.95, 359.95, 0.05, 0.05, -5.0, -5.1, -5.0, -5.1, 'B'),
+        (None, None, None, None, None, None, None, None, 'C'),
+    ]
+
+    def test_obs_bounds_to_moc(self):
+        (moc, projects) = obs_bounds_to_moc(
+            10, iter(self.obs_bounds), project_info=True)
+
+        self.assertEqual(projects, set(('A', 'B')))
+        self.assertEqual(moc.order, 10)
+        self.assertTrue(moc.contains(10, cell(10, 10.05, 20.05)))
+        self.assertTrue(moc.contains(10, cell(10, 0.0, -5.05)))
+        self.assertTrue(moc.contains(10, cell(10, 359.99, -5.05)))
+        self.assertFalse(moc.contains(10, cell(10, 180.0, 0.0)))
+
+        self.assertIsNone(obs_bounds_to_moc(10, []))
+
+    def test_obs_bounds_to_moc_parallel(self):
+        moc = obs_bounds_to_moc(10, self.obs_bounds)
+        moc_parallel = obs_bounds_to_moc(
+            10, iter(self.obs_bounds), processes=2, batch_size=1)
+
+        self.assertEqual(moc_parallel, moc)
+
+    def test_obs_bounds_to_moc_polygon(self):
+        moc = obs_bounds_to_moc(10, self.obs_bounds)
+        moc_polygon = obs_bounds_to_moc(10, self.obs_bounds, method='polygon')
+
+        # The polygon method should find at least the same cells.
+        self.assertEqual(moc_polygon.intersection(moc), moc)
+
+    def test_rectangle_polygon(self):
+        # Large map which is rejected by the mesh method.
+        rectangle = (12.0, 12.0, 0.0, 0.0, 6.0, -6.0, 6.0, -6.0)
+
+        with self.assertRaises(ValueError):
+            rectangle_to_healpix(2 ** 13, True, *rectangle)
+
+        cells = rectangle_to_healpix_polygon(2 ** 13, True, *rectangle)
+        self.assertIn(cell(13, 6.0, 0.0), cells)
+        self.assertIn(cell(13, 11.99, -5.99), cells)
+        self.assertNotIn(cell(13, 12.1, 0.0), cells)
+
+        # Degenerate rectangle.
+        rectangle = (1.0, 1.0, 1.0, 1.0, 2.0, 2.0, 2.0, 2.0)
+        self.assertEqual(
+            rectangle_to_healpix_polygon(2 ** 12, True, *rectangle).tolist(),
+            [cell(12, 1.0, 2.0)])
+
+    def test_rectangles_to_healpix(self):
+        nside = 2 ** 12
+        rectangles = [x[0:8] for x in self.obs_bounds[0:2]] + [
+            (5.3, 5.3, 5.0, 5.0, 1.2, 1.0, 1.2, 1.0),
+            (5.4, 5.4, 5.1, 5.1, 1.2, 1.0, 1.2, 1.0),
+            (30.0, 30.0, 0.0, 0.0, 5.0, -5.0, 5.0, -5.0),
+        ]
+
+        (cells, rejected) = rectangles_to_healpix(nside, True, rectangles)
+
+        self.assertEqual(rejected.tolist(), [False, False, False, False, True])
+
+        expected = set()
+        for rectangle in rectangles[0:4]:
+            expected.update(rectangle_to_healpix(nside, True, *rectangle))
+
+        # The vectorised method may use a slightly finer mesh, so
+        # pixels only just touching the edges could differ.
+        self.assertLess(len(expected.symmetric_difference(cells)),
+                        0.02 * len(expected))
+
+        (cells, rejected) = rectangles_to_healpix(nside, True, [])
+        self.assertEqual(len(cells), 0)
+        self.assertEqual(len(rejected), 0)
+
+    def test_obs_bounds_to_mocs(self):
+        obs_bounds = self.obs_bounds + [
+            (5.3, 5.3, 5.0, 5.0, 1.2, 1.0, 1.2, 1.0, 'A'),
+        ]
+
+        mocs = obs_bounds_to_mocs(10, iter(obs_bounds), 8, batch_size=1)
+
+        self.assertEqual(sorted(mocs.keys()), ['A', 'B'])
+        self.assertEqual(
+            mocs['A'],
+            obs_bounds_to_moc(10, [obs_bounds[0], obs_bounds[3]]))
+        self.assertEqual(mocs['B'], obs_bounds_to_moc(10, [obs_bounds[1]]))
+
+        # Merging across groups does not affect the result.
+        self.assertEqual(
+            obs_bounds_to_mocs(
+                10, iter(obs_bounds), 8, batch_size=1, threshold=2),
+            mocs)
+
+    def test_obs_bounds_to_mocs_null(self):
+        obs_bounds = self.obs_bounds + [
+            (5.3, 5.3, 5.0, 5.0, 1.2, 1.0, 1.2, 1.0, None),
+        ]
+
+        mocs = obs_bounds_to_mocs(11, iter(obs_bounds), 8)
+
+        self.assertEqual(group_file_names(mocs.keys()), [
+            ('A', 'A', 'A.fits'),
+            ('B', 'B', 'B.fits'),
+            (None, null_group_name, '_NULL_.fits'),
+        ])
+
+    def test_group_file_names(self):
+        self.assertEqual(group_file_names(['x y', 'X_Y', 'x?y']), [
+            ('X_Y', 'X_Y', 'X_Y.fits'),
+            ('x y', 'x y', 'x_y_2.fits'),
+            ('x?y', 'x?y', 'x_y_3.fits'),
+        ])
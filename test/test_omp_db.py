@@ -13,6 +13,530 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from contextlib import contextmanager
+from datetime import datetime
 from unittest import TestCase
 
-from omp.db.db import OMPDB
+from mysql.connector import FieldType
+import numpy as np
+
+from omp.db.db import IngestionPollState, OMPDB, \
+    _chunked, _group_rows, _in_params, _row_type, _row_type_from_description
+from omp.db.part import arc
+from omp.db.part.arc import ArcDB, read_retry_delay
+from omp.error import OMPDBError, OMPDBTransientError
+
+
+class DummyCursor(object):
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+        self.description = None
+        self.rowcount = 0
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.queries.append((query, args))
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        (self.description, self.rows) = result
+        self.rowcount = len(self.rows)
+
+    def fetchall(self):
+        (rows, self.rows) = (self.rows, [])
+        return rows
+
+    def fetchmany(self, size=1):
+        (rows, self.rows) = (self.rows[:size], self.rows[size:])
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany()
+        return rows[0] if rows else None
+
+
+class DummyDB(object):
+    """Stand-in for the MySQL backend, returning prepared results.
+
+    Each result should be a (description, rows) tuple.
+    """
+
+    def __init__(self, results):
+        self.cursor = DummyCursor(results)
+        self.n_transaction = 0
+
+    @contextmanager
+    def transaction(self, read_write=False):
+        self.n_transaction += 1
+        yield self.cursor
+
+
+def make_ompdb(results, cls=OMPDB):
+    db = cls.__new__(cls)
+    db.jcmt_db = 'jcmt.'
+    db.omp_db = 'omp.'
+    db.db = DummyDB(results)
+    return db
+
+
+class HelperTest(TestCase):
+    def test_chunked(self):
+        self.assertEqual(
+            list(_chunked(['a', 'b', 'a', 'c', 'd', 'e', 'b'], 2)),
+            [['a', 'b'], ['c', 'd'], ['e']])
+
+        self.assertEqual(list(_chunked([], 2)), [])
+
+    def test_in_params(self):
+        args = {'x': 1}
+        self.assertEqual(
+            _in_params('o', ['a', 'b'], args), '%(o0)s, %(o1)s')
+        self.assertEqual(args, {'x': 1, 'o0': 'a', 'o1': 'b'})
+
+    def test_group_rows(self):
+        row_type = _row_type('info', 'x')
+        rows = [('b', 1), ('a', 2), ('b', 3)]
+
+        result = _group_rows(rows, row_type)
+        self.assertEqual(list(result.keys()), ['b', 'a'])
+        self.assertEqual(result['b'], [(1,), (3,)])
+
+        result = _group_rows(iter(sorted(rows)), row_type, sorted_rows=True)
+        self.assertEqual(
+            list(result), [('a', [(2,)]), ('b', [(1,), (3,)])])
+
+    def test_row_type(self):
+        row_type = _row_type('info', 'a, b c')
+        self.assertEqual(row_type._fields, ('a', 'b', 'c'))
+        self.assertIs(_row_type('info', ['a', 'b', 'c']), row_type)
+        self.assertIsNot(_row_type('info', ['a', 'b']), row_type)
+
+        row_type = _row_type_from_description(
+            'info', (('obsid', None), ('from', None)))
+        self.assertEqual(row_type._fields, ('obsid', 'from_'))
+
+        row = row_type('x', 'y')
+        self.assertFalse(hasattr(row, '__dict__'))
+
+
+class ManyTest(TestCase):
+    def test_obsid_status_many(self):
+        db = make_ompdb([
+            (None, [('a', 1), ('c', 0)]),
+            (None, [('d', 2)]),
+        ])
+
+        self.assertEqual(
+            db.get_obsid_status_many(['a', 'b', 'c', 'd'], chunk_size=3),
+            {'a': 1, 'c': 0, 'd': 2})
+
+        self.assertEqual(db.db.n_transaction, 1)
+        self.assertEqual(len(db.db.cursor.queries), 2)
+        self.assertEqual(
+            db.db.cursor.queries[1][1], {'o0': 'd'})
+
+    def test_obsid_common_many(self):
+        db = make_ompdb([
+            ((('obsid',), ('utdate',)), [('a', 20260101), ('b', 20260102)]),
+        ])
+
+        result = db.get_obsid_common_many(['a', 'b', 'c'])
+
+        self.assertEqual(sorted(result.keys()), ['a', 'b'])
+        self.assertEqual(result['b'].utdate, 20260102)
+
+    def test_set_last_caom_mod_many(self):
+        db = make_ompdb([
+            (None, [None, None]),
+            (None, [None]),
+        ])
+
+        self.assertEqual(
+            db.set_last_caom_mod_many(
+                ['a', 'b', 'c'], timestamp='2026-01-01 00:00:00',
+                chunk_size=2),
+            [2, 1])
+
+        self.assertEqual(db.db.n_transaction, 1)
+
+        (query, args) = db.db.cursor.queries[1]
+        self.assertIn('last_caom_mod = %(t)s', query)
+        self.assertIn('last_modified = last_modified', query)
+        self.assertEqual(args, {'t': '2026-01-01 00:00:00', 'o0': 'c'})
+
+    def test_cso_tau_arrays(self):
+        db = make_ompdb([
+            ((('cso_ut', FieldType.DATETIME), ('tau', FieldType.DOUBLE)), [
+                (datetime(2026, 1, 1, 0, 0), 0.05),
+                (datetime(2026, 1, 1, 0, 10), None),
+                (datetime(2026, 1, 1, 0, 20), 0.07),
+            ]),
+        ])
+
+        result = db.get_cso_tau(20260101, 20260102, as_arrays=True)
+
+        self.assertEqual(list(result.keys()), ['date', 'tau'])
+        self.assertEqual(result['date'].dtype, np.dtype('datetime64[us]'))
+        self.assertEqual(
+            result['date'][1], np.datetime64('2026-01-01T00:10:00'))
+        self.assertEqual(list(result['tau'].mask), [False, True, False])
+        self.assertAlmostEqual(result['tau'].sum(), 0.12)
+
+    def test_project_info(self):
+        db = make_ompdb([
+            (None, [
+                ('PIUSER', 'P I', 'pi@x', 'pi', 1, 'PI'),
+                ('COIUSER', 'Co I', 'coi@x', None, 0, 'COI'),
+            ]),
+            (None, [
+                ('M26AP001', 'Title', '26A', 'PI', 10.0, 5.0, 0.0, 0.1,
+                 'enabled'),
+            ]),
+        ])
+
+        info = db.get_project_info('M26AP001')
+
+        self.assertEqual(db.db.n_transaction, 1)
+        self.assertEqual(info.opacityrange, (0.0, 0.1))
+        self.assertEqual([x.userid for x in info.pi], ['PIUSER'])
+        self.assertEqual([x.userid for x in info.cois], ['COIUSER'])
+        self.assertEqual(info.fops, [])
+
+        db = make_ompdb([(None, []), (None, [])])
+
+        with self.assertRaises(OMPDBError):
+            db.get_project_info('M26AP002')
+
+    def test_project_bundle(self):
+        db = make_ompdb([
+            (None, [('M26AP001', 1, 'open', 'Fault')]),
+            (None, [(20260101, 3600, 1)]),
+        ])
+
+        bundle = db.get_project_bundle(
+            'M26AP001', parts=['fault_summary', 'time_charged'])
+
+        self.assertEqual(db.db.n_transaction, 1)
+        self.assertEqual(bundle.projectcode, 'M26AP001')
+        self.assertIsNone(bundle.project_info)
+        self.assertEqual(bundle.fault_summary[0].faultid, 1)
+        self.assertEqual(bundle.time_charged[0].timespent, 3600)
+        self.assertEqual(
+            list(bundle.timing.keys()), ['fault_summary', 'time_charged'])
+
+        with self.assertRaises(OMPDBError):
+            db.get_project_bundle('M26AP001', parts=['unknown'])
+
+    def test_get_files_many(self):
+        db = make_ompdb([
+            (None, [('a', 'a_1', 'a1.sdf', 10, 'x'),
+                    ('a', 'a_1', 'a2.sdf', 20, 'y'),
+                    ('b', 'b_2', 'b1.sdf', 30, 'z')]),
+        ], cls=ArcDB)
+
+        result = db.get_files_many(['a', 'b', 'c'])
+
+        self.assertEqual(result, {
+            'a': {'a_1': ['a1.sdf', 'a2.sdf']},
+            'b': {'b_2': ['b1.sdf']},
+            'c': None,
+        })
+
+        (query, args) = db.db.cursor.queries[0]
+        self.assertIn('obsid IN (%(o0)s, %(o1)s, %(o2)s)', query)
+        self.assertEqual(args, {'o0': 'a', 'o1': 'b', 'o2': 'c'})
+
+    def test_query_table_many(self):
+        db = make_ompdb([
+            (None, [('a', 'a_1', '450', 450.0, 32.0),
+                    ('a', 'a_2', '850', 850.0, 85.0)]),
+            (None, []),
+        ], cls=ArcDB)
+
+        result = db.query_table_many('SCUBA2', ['a', 'b'], chunk_size=1)
+
+        self.assertEqual(len(db.db.cursor.queries), 2)
+        self.assertEqual(result['b'], [])
+        self.assertEqual(
+            [x['obsid_subsysnr'] for x in result['a']], ['a_1', 'a_2'])
+        self.assertEqual(result['a'][1]['wavelen'], 850.0)
+
+        db = make_ompdb([(None, [])], cls=ArcDB)
+        self.assertEqual(db.query_table('SCUBA2', 'x'), [])
+
+    def test_observation_contexts(self):
+        def row(table, obsid, **kwargs):
+            return (obsid,) + tuple(
+                kwargs.get(x) for x in ArcDB.query_table_columns[table])
+
+        db = make_ompdb([
+            (None, [row('COMMON', 'a', backend='SCUBA-2', project='P1'),
+                    row('COMMON', 'b', backend='ACSIS', project='P1')]),
+            (None, [row('ACSIS', 'b', obsid_subsysnr='b_1')]),
+            (None, [('a', 'a_1', '850', 850.0, 85.0)]),
+            (None, [('a', 'a_1', 'a1.sdf', 10, 'x')]),
+            (None, [('b', 1, 345.0, '1000MHzx2048', 1, 1, 0.5)]),
+            (None, [('PI Name', 'Title')]),
+        ], cls=ArcDB)
+
+        contexts = list(db.iter_observation_contexts(['a', 'b', 'c']))
+
+        self.assertEqual([x.obsid for x in contexts], ['a', 'b', 'c'])
+
+        (a, b, c) = contexts
+        self.assertEqual(a.common['backend'], 'SCUBA-2')
+        self.assertEqual(a.instrument[0]['wavelen'], 850.0)
+        self.assertEqual(a.files, {'a_1': ['a1.sdf']})
+        self.assertIsNone(a.product_info)
+        self.assertEqual((a.project_pi, a.project_title), ('PI Name', 'Title'))
+
+        self.assertEqual(b.instrument[0]['obsid_subsysnr'], 'b_1')
+        self.assertIsNone(b.files)
+        self.assertEqual(len(b.product_info), 1)
+        self.assertEqual(b.project_title, 'Title')
+
+        self.assertIsNone(c.common)
+
+    def test_heterodyne_product_info_many(self):
+        db = make_ompdb([
+            (None, [('a', 1, 345.0, 'bw', 1, 2, 0.5),
+                    ('a', 2, 345.0, 'bw', 1, 2, 0.5)]),
+            (None, [('b', 1, 230.0, 'bw', 1, 1, 0.5)]),
+        ], cls=ArcDB)
+
+        result = db.get_heterodyne_product_info_many(
+            'ACSIS', utdate_start=20260130, utdate_end=20260205, page_days=5)
+
+        self.assertEqual(sorted(result.keys()), ['a', 'b'])
+        self.assertEqual(len(result['a']), 2)
+        self.assertEqual(result['b'], [(1, 230.0, 'bw', 1, 1, 0.5)])
+
+        self.assertEqual(
+            [(x[1]['ds'], x[1]['de']) for x in db.db.cursor.queries],
+            [(20260130, 20260203), (20260204, 20260205)])
+
+        db = make_ompdb([(None, [])], cls=ArcDB)
+        self.assertEqual(db.get_heterodyne_product_info('DAS', 'x'), [])
+        self.assertEqual(db.db.cursor.queries[0][1], {'o0': 'x'})
+
+    def test_read_retry(self):
+        db = make_ompdb([
+            OMPDBTransientError('lost connection'),
+            (None, [(1,), (2,)]),
+        ], cls=ArcDB)
+
+        self.assertEqual(db.read('SELECT x', retry_delay=0), [(1,), (2,)])
+        self.assertEqual(len(db.db.cursor.queries), 2)
+
+        db = make_ompdb([
+            OMPDBTransientError('lost connection'),
+            (None, [(i,) for i in range(5)]),
+        ], cls=ArcDB)
+
+        rows = db.read('SELECT x', iterate=True, batch_size=2, retry_delay=0)
+        self.assertEqual(list(rows), [(i,) for i in range(5)])
+
+        db = make_ompdb([
+            OMPDBTransientError('lost connection'),
+            OMPDBTransientError('lost connection'),
+        ], cls=ArcDB)
+
+        with self.assertRaises(OMPDBTransientError):
+            db.read('SELECT x', retries=1, retry_delay=0)
+
+        db = make_ompdb([OMPDBError('syntax error')], cls=ArcDB)
+
+        with self.assertRaises(OMPDBError):
+            db.read('SELECT x', retry_delay=0)
+
+    def test_read_many_retry(self):
+        # The batched lookups retry the whole transaction, discarding
+        # the results of the failed attempt.
+        db = make_ompdb([
+            (None, [('a', 'a_1', 'a1.sdf', 10, 'x')]),
+            OMPDBTransientError('lost connection'),
+            (None, [('a', 'a_1', 'a1.sdf', 10, 'x')]),
+            (None, [('b', 'b_1', 'b1.sdf', 20, 'y')]),
+        ], cls=ArcDB)
+
+        arc.read_retry_delay = 0
+        try:
+            result = db.get_files_many(['a', 'b'], chunk_size=1)
+        finally:
+            arc.read_retry_delay = read_retry_delay
+
+        self.assertEqual(result, {
+            'a': {'a_1': ['a1.sdf']},
+            'b': {'b_1': ['b1.sdf']},
+        })
+        self.assertEqual(len(db.db.cursor.queries), 4)
+        self.assertEqual(db.db.n_transaction, 2)
+
+    def test_iterate_paged(self):
+        bounds = (1.0, 1.0, 2.0, 2.0, 3.0, 4.0, 3.0, 4.0)
+
+        # Each page of obsid values may have several ACSIS rows.
+        db = make_ompdb([
+            (None, [('a',), ('b',)]),
+            (None, [bounds, bounds, bounds]),
+            (None, [('c',)]),
+            (None, [bounds, bounds]),
+        ], cls=ArcDB)
+
+        rows = db.get_obs_bounds(
+            project='P1', acsis_info=False, rest_freq=345.8,
+            iterate=True, batch_size=2)
+
+        self.assertEqual(list(rows), [bounds] * 5)
+
+        # Each page is fetched in its own transaction, continuing
+        # after the last obsid of the previous page.
+        self.assertEqual(db.db.n_transaction, 2)
+
+        queries = db.db.cursor.queries
+        self.assertEqual(len(queries), 4)
+
+        # Obsid values are selected from COMMON alone.
+        (query, args) = queries[0]
+        self.assertTrue(query.startswith(
+            'SELECT jcmt.COMMON.obsid FROM jcmt.COMMON WHERE'))
+        self.assertNotIn('ACSIS', query)
+        self.assertNotIn('restfreq', query)
+        self.assertIn('ORDER BY jcmt.COMMON.obsid LIMIT 2', query)
+        self.assertNotIn('page_start', args)
+
+        # The joined rows are then fetched for that range of obsid values.
+        (query, args) = queries[1]
+        self.assertIn('LEFT JOIN jcmt.ACSIS', query)
+        self.assertIn('restfreq', query)
+        self.assertIn('jcmt.COMMON.obsid<=%(page_end)s', query)
+        self.assertNotIn('LIMIT', query)
+        self.assertEqual(args['page_end'], 'b')
+        self.assertEqual(args['p'], 'P1')
+
+        (query, args) = queries[2]
+        self.assertIn('jcmt.COMMON.obsid>%(page_start)s', query)
+        self.assertEqual(args['page_start'], 'b')
+
+        (query, args) = queries[3]
+        self.assertIn('jcmt.COMMON.obsid>%(page_start)s', query)
+        self.assertIn('jcmt.COMMON.obsid<=%(page_end)s', query)
+        self.assertEqual(args['page_start'], 'b')
+        self.assertEqual(args['page_end'], 'c')
+
+    def test_iterate_query(self):
+        db = make_ompdb([(None, [(i,) for i in range(5)])])
+
+        rows = db._iterate_query('SELECT x', {}, batch_size=2)
+
+        self.assertEqual(db.db.n_transaction, 0)
+        self.assertEqual(list(rows), [(i,) for i in range(5)])
+        self.assertEqual(db.db.n_transaction, 1)
+
+    def test_latest_obslog_join(self):
+        db = make_ompdb([(None, [])])
+
+        self.assertEqual(db.get_summary_obs_info('M26A%'), [])
+
+        (query, args) = db.db.cursor.queries[0]
+        self.assertIn('JOIN (SELECT obsid, MAX(obslogid) AS obslogid', query)
+        self.assertNotIn('o2.obsid', query)
+        self.assertEqual(args, {'p': 'M26A%'})
+
+        # The derived table is restricted by the same COMMON conditions
+        # as the outer query.
+        self.assertIn(
+            'FROM omp.ompobslog WHERE obsid IN (SELECT obsid FROM '
+            'jcmt.COMMON WHERE project LIKE %(p)s)', query)
+
+    def test_latest_obslog_join_restrict(self):
+        db = make_ompdb([(None, [])])
+
+        self.assertIsNone(db.get_observations(
+            None, utdatestart=20260101, utdateend=20260131))
+
+        (query, args) = db.db.cursor.queries[0]
+        self.assertIn(
+            'WHERE obsactive=1 AND obsid IN (SELECT obsid FROM jcmt.COMMON '
+            'WHERE utdate >= %(s)s AND utdate <= %(e)s)', query)
+        self.assertIn('c.utdate >= %(s)s', query)
+
+
+class IngestionPollTest(TestCase):
+    def test_incremental(self):
+        state = IngestionPollState()
+
+        db = make_ompdb([
+            (None, [(100,)]),
+            (None, [(5,)]),
+            (None, [('a', 1), ('b', 0), ('c', 1)]),
+        ])
+
+        self.assertEqual(
+            db.find_obs_for_ingestion(20260101, poll_state=state), ['a', 'c'])
+        self.assertEqual(len(db.db.cursor.queries), 3)
+        self.assertNotIn('last_modified >=', db.db.cursor.queries[2][0])
+
+        self.assertTrue(state.is_initialized())
+        self.assertEqual(state.last_modified, 100)
+        self.assertEqual(state.obslogid, 5)
+        self.assertEqual(state.pending, set(('a', 'b', 'c')))
+
+        # Next poll: only changed observations and those still pending.
+        db = make_ompdb([
+            (None, [(101,)]),
+            (None, [(6,)]),
+            (None, [('d', 1)]),
+            (None, [('b', 1)]),
+        ])
+
+        self.assertEqual(
+            db.find_obs_for_ingestion(20260101, poll_state=state), ['d', 'b'])
+
+        queries = db.db.cursor.queries
+        self.assertEqual(len(queries), 4)
+        self.assertIn('last_modified >= %(lm)s', queries[2][0])
+        self.assertEqual(queries[2][1]['lm'], 100)
+        self.assertEqual(queries[2][1]['ol'], 5)
+        self.assertEqual(
+            sorted(v for (k, v) in queries[3][1].items()
+                   if k.startswith('pending')),
+            ['a', 'b', 'c'])
+
+        self.assertEqual(state.pending, set(('b', 'd')))
+
+    def test_incremental_overlap(self):
+        state = IngestionPollState(overlap_minutes=15, overlap_obslogid=20)
+
+        db = make_ompdb([
+            (None, [(datetime(2026, 1, 1, 9, 45),)]),
+            (None, [(480,)]),
+            (None, []),
+        ])
+
+        self.assertEqual(
+            db.find_obs_for_ingestion(20260101, poll_state=state), [])
+
+        # The marks are read less the overlaps.
+        queries = db.db.cursor.queries
+        self.assertIn('MAX(last_modified) - INTERVAL %(om)s MINUTE',
+                      queries[0][0])
+        self.assertEqual(queries[0][1], {'om': 15})
+        self.assertIn('MAX(obslogid) - %(oo)s', queries[1][0])
+        self.assertEqual(queries[1][1], {'oo': 20})
+
+        # An observation committed late, with last_modified before the
+        # latest value seen by the previous poll, is found by the next.
+        db = make_ompdb([
+            (None, [(datetime(2026, 1, 1, 9, 50),)]),
+            (None, [(481,)]),
+            (None, [('late', 1)]),
+        ])
+
+        self.assertEqual(
+            db.find_obs_for_ingestion(20260101, poll_state=state), ['late'])
+
+        (query, args) = db.db.cursor.queries[2]
+        self.assertEqual(args['lm'], datetime(2026, 1, 1, 9, 45))
+        self.assertEqual(args['ol'], 480)